@@ -1,15 +1,14 @@
 #!/usr/bin/env python
 
-import sys
 import numpy as np
 from astropy import units as u
 from astropy.coordinates import SkyCoord, FK5, Angle
-from astropy.cosmology import Planck15
+from cosmology import distmod
 
 def main():
     x1 = input('Redshift:')
     z = float(x1)
-    mu = Planck15.distmod(z).value
+    mu = distmod(z, 'Planck15')
     d = 10**(mu/5 + 1)
 
     x2 = input('Convert from [arsec]/coords/dist:')
@@ -40,4 +39,5 @@ def main():
         print('-------------------------------------')
         print('Arsec:', arsec)
         
-main()
+if __name__ == "__main__":
+    main()
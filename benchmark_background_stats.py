@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+from astropy.io import fits
+
+from check_background import extract_image, get_astropy_stats, estimate_astropy_stats
+
+def synthetic_image(size=4000, seed=0):
+    """Creates a noisy image with a background gradient and some sources.
+
+    Parameters
+    ----------
+    size: int, default '4000'
+        Size of the (square) image, in pixels.
+    seed: int, default '0'
+        Seed of the random number generator.
+
+    Returns
+    -------
+    data: ndarray
+        Image data/counts.
+    """
+    rng = np.random.default_rng(seed)
+    data = rng.normal(100, 5, (size, size)).astype(np.float32)
+    data += np.linspace(0, 2, size, dtype=np.float32)[None, :]  # gradient
+    # bright sources
+    for x, y in rng.integers(10, size - 10, (size // 10, 2)):
+        data[y - 3:y + 4, x - 3:x + 4] += rng.uniform(50, 500)
+
+    return data
+
+def check_scaled_image(data):
+    """Checks that a scaled-integer image (unsigned 16 bits, with ``BZERO = 32768``)
+    gives the same data in the default and low-memory modes of :func:`extract_image()`.
+
+    Parameters
+    ----------
+    data: ndarray
+        Image data/counts.
+
+    Returns
+    -------
+    passed: bool
+        Whether both modes give the same data.
+    """
+    counts = np.clip(np.round(data), 0, 2**16 - 1).astype(np.uint16)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file = os.path.join(temp_dir, 'scaled.fits')
+        fits.PrimaryHDU(data=counts).writeto(file)  # stored as int16 with BZERO
+        default_data = extract_image(file)[0]
+        low_memory_data = extract_image(file, low_memory=True)[0]
+
+    return bool(np.array_equal(default_data, low_memory_data))
+
+def benchmark_stats(data, n_samples_list=(1000, 10000, 100000, 1000000), n_repeats=5):
+    """Compares the speed and accuracy of the approximate Astropy
+    statistics against the exact computation.
+
+    Parameters
+    ----------
+    data: ndarray
+        Image data/counts.
+    n_samples_list: list, default '(1000, 10000, 100000, 1000000)'
+        Number of pixels used by the approximate estimators.
+    n_repeats: int, default '5'
+        Number of repetitions (with different seeds) per configuration.
+
+    Returns
+    -------
+    bench_df: DataFrame
+        Run time, speedup, actual error and reported uncertainty
+        of the mean, per estimator and number of pixels.
+    """
+    start = time.perf_counter()
+    exact_mean, exact_median, exact_std = get_astropy_stats(data)
+    exact_time = time.perf_counter() - start
+
+    bench_dict = {'estimator':['exact'], 'n_samples':[data.size], 'time':[exact_time],
+                  'speedup':[1.0], 'mean_error':[0.0], 'mean_err_reported':[0.0]}
+    for estimator in ['subsample', 'tiles']:
+        for n_samples in n_samples_list:
+            times, errors, reported = [], [], []
+            for seed in range(n_repeats):
+                start = time.perf_counter()
+                stats, stats_err = estimate_astropy_stats(data, estimator=estimator,
+                                                          n_samples=n_samples, seed=seed)
+                times.append(time.perf_counter() - start)
+                errors.append(stats[0] - exact_mean)
+                reported.append(stats_err[0])
+
+            bench_dict['estimator'].append(estimator)
+            bench_dict['n_samples'].append(n_samples)
+            bench_dict['time'].append(np.median(times))
+            bench_dict['speedup'].append(exact_time / np.median(times))
+            bench_dict['mean_error'].append(np.sqrt(np.mean(np.square(errors))))  # RMS
+            bench_dict['mean_err_reported'].append(np.mean(reported))
+    bench_df = pd.DataFrame(bench_dict)
+
+    return bench_df
+
+def main(args=None):
+    description = f"Benchmarks the approximate background statistics of check_background"
+    usage = "benchmark_background_stats [file] [options]"
+
+    parser = argparse.ArgumentParser(prog='benchmark_background_stats',
+                                     usage=usage,
+                                     description=description,
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+    parser.add_argument("file",
+                        nargs="?",
+                        type=str,
+                        help="Name of the FITS file. If not given, a synthetic image is used."
+                        )
+    parser.add_argument("--size",
+                        dest="size",
+                        action="store",
+                        default=4000,
+                        type=int,
+                        help="Size of the synthetic image, in pixels."
+                        )
+    parser.add_argument("-r",
+                        "--repeats",
+                        dest="repeats",
+                        action="store",
+                        default=20,
+                        type=int,
+                        help="Number of repetitions per configuration."
+                        )
+
+    args = parser.parse_args(args)
+    if args.file is not None:
+        data = extract_image(args.file)[0]
+    else:
+        data = synthetic_image(args.size)
+
+    if check_scaled_image(data) is False:
+        print("WARNING: the low-memory mode does not load scaled-integer images correctly")
+        sys.exit(1)
+
+    bench_df = benchmark_stats(data, n_repeats=args.repeats)
+    print(bench_df.to_string(index=False, float_format='%.4g'))
+
+    # the reported uncertainties must cover the actual errors, within
+    # twice the relative uncertainty of the RMS of `repeats` errors
+    tolerance = 1 + 2 / np.sqrt(2 * args.repeats)
+    underestimated = bench_df[bench_df.mean_error > tolerance * bench_df.mean_err_reported]
+    for _, row in underestimated.iterrows():
+        print(f"WARNING: the '{row.estimator}' estimator with {row.n_samples} pixels reports "
+              f"{row.mean_err_reported:.4g}, but its actual error is {row.mean_error:.4g}")
+    if len(underestimated) > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
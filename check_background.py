@@ -2,34 +2,115 @@
 
 import os
 import sys
+import time
+import json
+import signal
+import sqlite3
+import hashlib
 import argparse
+import socketserver
+from concurrent.futures import ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
 import numpy as np
 import pandas as pd
+import matplotlib.image
 import matplotlib.pyplot as plt
 
 import sep
 import aplpy
 from astropy import wcs
+from astropy.wcs.utils import proj_plane_pixel_scales
 from astropy.io import fits
 from astropy import units as u
+from astropy.time import Time
 from astropy.coordinates import SkyCoord
 from astropy.stats import sigma_clipped_stats
 from photutils.aperture import ApertureStats
 from photutils.aperture import SkyCircularAnnulus
+from local_cache import atomic_write
 
-from hostphot._constants import font_family
-from hostphot.utils import suppress_stdout
+# hostphot may print messages when imported, which would corrupt
+# the JSON responses written to the standard output in server mode
+from contextlib import redirect_stdout
+with redirect_stdout(sys.stderr):
+    from hostphot._constants import font_family
+    from hostphot.utils import suppress_stdout
 
 import warnings
 from astropy.utils.exceptions import AstropyWarning
 
-def extract_image(file):
+# columns of the results store
+STORE_COLUMNS = {'file':'TEXT', 'name':'TEXT', 'date_obs':'TEXT', 'run_date':'TEXT',
+                 'ra':'REAL', 'dec':'REAL', 'r_in':'REAL', 'r_out':'REAL', 'method':'TEXT',
+                 'sep_diff':'REAL', 'astro_diff':'REAL', 'sep_mean':'REAL', 'sep_std':'REAL',
+                 'astro_mean':'REAL', 'astro_median':'REAL', 'astro_std':'REAL',
+                 'astro_mean_err':'REAL', 'astro_median_err':'REAL', 'astro_std_err':'REAL',
+                 'astro_estimator':'TEXT', 'annulus_bkg':'REAL', 'annulus_std':'REAL',
+                 'annulus_percent':'REAL', 'status':'TEXT'}
+# approximate background statistics (see estimate_astropy_stats): batches of the
+# 'subsample' estimator, minimum number of tiles and bootstrap resamples of the 'tiles' one
+N_BATCHES, MIN_TILES, N_BOOTSTRAP = 20, 32, 200
+
+def get_native_dtype(dtype):
+    """Obtains the lowest-precision native dtype that keeps
+    the precision of the given image dtype.
+
+    Single precision is used for integers of up to 16 bits and for
+    single-precision floats. Double precision is kept for anything else,
+    as 32-bit integers do not fit in the mantissa of a single-precision float.
+
+    Parameters
+    ----------
+    dtype: ~numpy.dtype
+        Image dtype, as stored on disk.
+
+    Returns
+    -------
+    native_dtype: ~numpy.dtype
+        Native byte-order dtype.
+    """
+    if dtype.itemsize <= 2 or (dtype.kind == 'f' and dtype.itemsize == 4):
+        native_dtype = np.dtype(np.float32)
+    else:
+        native_dtype = np.dtype(np.float64)
+
+    return native_dtype
+
+def get_image_hdu(hdul):
+    """Obtains the first HDU with an image, e.g. the first extension
+    of tile-compressed (fpack) files.
+
+    Parameters
+    ----------
+    hdul: ~fits.HDUList
+        List of Header Data Units.
+
+    Returns
+    -------
+    hdu: ~fits.hdu
+        Image Header Data Unit.
+    """
+    for hdu in hdul:
+        # the header is checked to avoid loading/decompressing the data
+        if hdu.is_image and hdu.header.get('NAXIS', 0) >= 2:
+            return hdu
+    raise ValueError("No image found in the FITS file!")
+
+def extract_image(file, low_memory=False):
     """Obtains the data and other information from a FITS file.
 
+    In low-memory mode, the file is memory-mapped and the data is converted
+    only once into a native byte-order array of the lowest precision needed
+    (see :func:`get_native_dtype()`). Scaled integers (``BZERO``, ``BSCALE`` and
+    ``BLANK`` keywords, e.g. unsigned 16-bit images) are scaled into this array,
+    as astropy cannot memory-map them. The returned HDU shares this array, so the
+    statistics and the plotting use the same array.
+
     Parameters
     ----------
     file: str
         Name of the FITS file.
+    low_memory: bool, default 'False'
+        Whether to use the low-memory mode.
 
     Returns
     -------
@@ -42,15 +123,94 @@ def extract_image(file):
     hdu: ~fits.hdu
         Image Header Data Unit.
     """
-    hdu = fits.open(file)
+    with fits.open(file, memmap=low_memory, do_not_scale_image_data=low_memory) as hdul:
+        img_hdu = get_image_hdu(hdul)
+        header = img_hdu.header.copy()
+        data = img_hdu.data
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", AstropyWarning)
+            img_wcs = wcs.WCS(header, naxis=2)
+
+        if low_memory:
+            # FITS data is big-endian, so a single copy is needed for SEP
+            raw_data = data
+            data = raw_data.astype(get_native_dtype(raw_data.dtype))
+            bscale, bzero = header.get('BSCALE', 1), header.get('BZERO', 0)
+            if bscale != 1:
+                data *= bscale
+            if bzero != 0:
+                data += bzero
+            if raw_data.dtype.kind in 'iu' and 'BLANK' in header:
+                data[raw_data == header['BLANK']] = np.nan
+            for key in ['BSCALE', 'BZERO', 'BLANK']:
+                header.remove(key, ignore_missing=True)
+        else:
+            data = data.astype(np.float64)
+    hdu = fits.PrimaryHDU(data=data, header=header)
     
-    header = hdu[0].header
-    data = hdu[0].data
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore", AstropyWarning)
-        img_wcs = wcs.WCS(header, naxis=2)
+    return data, header, img_wcs, hdu
+
+def extract_cutout(file, ra, dec, radius, low_memory=False):
+    """Obtains the data and other information of the region around
+    the given coordinates from a FITS file.
+
+    Only the pixels in the region are read from disk. For tile-compressed
+    files, only the tiles overlapping the region are decompressed.
 
-    data = data.astype(np.float64)
+    Parameters
+    ----------
+    file: str
+        Name of the FITS file.
+    ra: float or array-like
+        Right ascension(s). The region covers all the coordinates.
+    dec: float or array-like
+        Declination(s).
+    radius: float
+        Margin around the coordinates, in arcsec.
+    low_memory: bool, default 'False'
+        Whether to keep the data in single precision when 
+        double precision is not needed (see :func:`get_native_dtype()`).
+
+    Returns
+    -------
+    data: ndarray
+        Cutout data/counts.
+    header: ~fits.header
+        Cutout header.
+    img_wcs: ~astropy.wcs
+        Cutout WCS.
+    hdu: ~fits.hdu
+        Cutout Header Data Unit.
+    """
+    with fits.open(file) as hdul:
+        img_hdu = get_image_hdu(hdul)
+        header = img_hdu.header.copy()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", AstropyWarning)
+            img_wcs = wcs.WCS(header, naxis=2)
+
+        # pixel limits of the region
+        coords = SkyCoord(ra=ra, dec=dec, unit=(u.degree, u.degree), frame="icrs")
+        x, y = img_wcs.world_to_pixel(coords)
+        pixel_scale = np.mean(proj_plane_pixel_scales(img_wcs)) * 3600  # arcsec/pixel
+        half_size = int(np.ceil(radius / pixel_scale)) + 1
+        ny, nx = img_hdu.shape[-2:]
+        x0 = max(int(np.round(np.min(x))) - half_size, 0)
+        x1 = min(int(np.round(np.max(x))) + half_size + 1, nx)
+        y0 = max(int(np.round(np.min(y))) - half_size, 0)
+        y1 = min(int(np.round(np.max(y))) + half_size + 1, ny)
+        if x0 >= x1 or y0 >= y1:
+            raise ValueError(f"The coordinates ({ra}, {dec}) are outside the image!")
+
+        data = img_hdu.section[y0:y1, x0:x1]
+
+    if low_memory:
+        data = data.astype(get_native_dtype(data.dtype))
+    else:
+        data = data.astype(np.float64)
+    img_wcs = img_wcs[y0:y1, x0:x1]
+    header.update(img_wcs.to_header())
+    hdu = fits.PrimaryHDU(data=data, header=header)
     
     return data, header, img_wcs, hdu
 
@@ -100,6 +260,277 @@ def get_astropy_stats(data, sigma=3.0):
     
     return mean, median, std
 
+def estimate_astropy_stats(data, sigma=3.0, estimator='subsample', n_samples=100000, 
+                           tile_size=64, seed=0):
+    """Estimates the background mean, median and std from an array
+    using Astropy's sigma-clipping stats on a fraction of the pixels.
+
+    The 'subsample' estimator uses random pixels, while the 'tiles' estimator
+    uses random square tiles and combines their statistics with the median, which 
+    is more robust against gradients and large sources. The tiles are shrunk if 
+    needed, so that at least ``MIN_TILES`` tiles are used without exceeding ``n_samples``.
+    The uncertainties are measured from the data: from the scatter between 
+    ``N_BATCHES`` independent batches of the random pixels ('subsample'), or by 
+    bootstrapping the tiles ('tiles'). They do not include the offset between the 
+    median of the tiles and the statistics of the whole image (e.g. with strong 
+    gradients), so they are lower bounds for the 'tiles' estimator. Images narrower
+    than the tiles use the 'subsample' estimator instead. The 'exact' 
+    estimator falls back to :func:`get_astropy_stats()`, with zero uncertainties.
+
+    Parameters
+    ----------
+    data: ndarray
+        Image data/counts.
+    sigma: float, default '3.0'
+        Sigma used for the sigma clipping.
+    estimator: str, default 'subsample'
+        Either 'exact', 'subsample' or 'tiles'.
+    n_samples: int, default '100000'
+        Number of pixels used. Larger values are more accurate, but slower.
+    tile_size: int, default '64'
+        Maximum size of the tiles, in pixels. Only used by the 'tiles' estimator.
+    seed: int, default '0'
+        Seed of the random number generator, for reproducible estimates.
+
+    Returns
+    -------
+    stats: tuple
+        Background mean, median and std.
+    errors: tuple
+        Uncertainties of the background mean, median and std.
+    """
+    assert estimator in ['exact', 'subsample', 'tiles'], "Not a valid estimator!"
+    rng = np.random.default_rng(seed)
+
+    if estimator == 'exact' or n_samples >= data.size:
+        mean, median, std = get_astropy_stats(data, sigma)
+        return (mean, median, std), (0.0, 0.0, 0.0)
+
+    if estimator == 'tiles':
+        tile_size = min(tile_size, max(int(np.sqrt(n_samples / MIN_TILES)), 4))
+        if tile_size > min(data.shape):
+            estimator = 'subsample'  # the tiles do not fit in narrow images
+
+    if estimator == 'subsample':
+        indices = rng.integers(0, data.size, n_samples)
+        sample = data.ravel()[indices]
+        mean, median, std = sigma_clipped_stats(sample, sigma=sigma)
+        # the scatter between batches includes the effect of the clipping and of
+        # non-Gaussian backgrounds, unlike the analytic standard errors
+        n_batches = max(min(N_BATCHES, n_samples // 10), 2)
+        batches = sample[:n_batches * (n_samples // n_batches)].reshape(n_batches, -1)
+        batches_stats = sigma_clipped_stats(batches, sigma=sigma, axis=1)
+        mean_err, median_err, std_err = [np.nanstd(stat, ddof=1) / np.sqrt(n_batches)
+                                         for stat in batches_stats]
+    else:
+        ny, nx = data.shape[0] // tile_size, data.shape[1] // tile_size
+        n_tiles = min(max(n_samples // tile_size**2, 2), ny * nx)
+        tile_ids = rng.choice(ny * nx, n_tiles, replace=False)
+        tiles = np.array([data[i * tile_size:(i + 1) * tile_size, j * tile_size:(j + 1) * tile_size]
+                          for i, j in zip(tile_ids // nx, tile_ids % nx)])
+        tiles_stats = sigma_clipped_stats(tiles.reshape(n_tiles, -1), sigma=sigma, axis=1)
+        # median across tiles, with its bootstrap error
+        mean, median, std = [np.nanmedian(stat) for stat in tiles_stats]
+        resamples = rng.integers(0, n_tiles, (N_BOOTSTRAP, n_tiles))
+        mean_err, median_err, std_err = [np.nanstd(np.nanmedian(stat[resamples], axis=1))
+                                         for stat in tiles_stats]
+
+    return (mean, median, std), (mean_err, median_err, std_err)
+
+def get_file_hash(file, cache_dir, chunk_size=2**20):
+    """Obtains the hash of the content of a file.
+
+    Hashing large images is expensive, so the hash is memoised in the cache
+    directory and only recomputed if the size or modification time of the
+    file changes.
+
+    Parameters
+    ----------
+    file: str
+        Name of the file.
+    cache_dir: str
+        Cache directory.
+    chunk_size: int, default '2**20'
+        Number of bytes read at a time.
+
+    Returns
+    -------
+    file_hash: str
+        BLAKE2 hash of the file content.
+    """
+    file_stat = os.stat(file)
+    path_hash = hashlib.blake2b(os.path.abspath(file).encode(), digest_size=16).hexdigest()
+    memo_file = os.path.join(cache_dir, 'files', path_hash + '.json')
+    memo = _read_json(memo_file)
+    if (memo is not None and memo['size'] == file_stat.st_size
+        and memo['mtime'] == file_stat.st_mtime_ns):
+        return memo['hash']
+
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(file, 'rb') as fits_file:
+        for chunk in iter(lambda: fits_file.read(chunk_size), b''):
+            hasher.update(chunk)
+    file_hash = hasher.hexdigest()
+    memo = {'size':file_stat.st_size, 'mtime':file_stat.st_mtime_ns, 'hash':file_hash}
+    _write_json(memo_file, memo)
+
+    return file_hash
+
+def _read_json(file):
+    """Reads a JSON file, returning ``None`` if it is missing or corrupted.
+    """
+    try:
+        with open(file, 'r') as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(file, content):
+    """Writes a JSON file atomically, so concurrent readers never see partial files.
+    """
+    with atomic_write(file) as json_file:
+        json.dump(content, json_file)
+
+def get_cache_key(file, cache_dir, **params):
+    """Obtains the cache key of the global statistics of an image.
+
+    Parameters
+    ----------
+    file: str
+        Name of the FITS file.
+    cache_dir: str
+        Cache directory.
+    params: dict
+        Parameters used to calculate the statistics.
+
+    Returns
+    -------
+    cache_key: str
+        Key combining the file content and the parameters.
+    """
+    file_hash = get_file_hash(file, cache_dir)
+    params_str = json.dumps(params, sort_keys=True, default=str)
+    cache_key = hashlib.blake2b((file_hash + params_str).encode(), digest_size=16).hexdigest()
+
+    return cache_key
+
+def load_cached_stats(cache_dir, cache_key):
+    """Loads the global statistics of an image from the cache.
+
+    Parameters
+    ----------
+    cache_dir: str
+        Cache directory.
+    cache_key: str
+        Key from :func:`get_cache_key()`.
+
+    Returns
+    -------
+    stats: dict or None
+        Global statistics. ``None`` if not found in the cache.
+    """
+    stats_file = os.path.join(cache_dir, 'stats', cache_key + '.json')
+    stats = _read_json(stats_file)
+    if stats is not None:
+        try:
+            os.utime(stats_file)  # mark as recently used
+        except FileNotFoundError:
+            return None  # evicted by another process in the meantime
+
+    return stats
+
+def save_cached_stats(cache_dir, cache_key, stats, max_entries=1000):
+    """Saves the global statistics of an image into the cache.
+
+    The least recently used entries are evicted when there are more
+    than ``max_entries``.
+
+    Parameters
+    ----------
+    cache_dir: str
+        Cache directory.
+    cache_key: str
+        Key from :func:`get_cache_key()`.
+    stats: dict
+        Global statistics.
+    max_entries: int, default '1000'
+        Maximum number of images in the cache.
+    """
+    stats_dir = os.path.join(cache_dir, 'stats')
+    _write_json(os.path.join(stats_dir, cache_key + '.json'), stats)
+
+    entries = [entry for entry in os.scandir(stats_dir) if entry.name.endswith('.json')]
+    if len(entries) > max_entries:
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - max_entries]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass  # already evicted by another process
+
+def load_image_and_stats(file, ra, dec, radius, low_memory=False, cache_dir=None, 
+                         estimator='exact', n_samples=100000):
+    """Loads an image and obtains its global background statistics.
+
+    If the statistics are found in the cache, only the region around the
+    coordinates is read (see :func:`extract_cutout()`). Otherwise, the whole
+    image is read and the statistics are calculated (and cached).
+
+    Parameters
+    ----------
+    file: str
+        Name of the FITS file.
+    ra: float or array-like
+        Right ascension(s).
+    dec: float or array-like
+        Declination(s).
+    radius: float
+        Margin around the coordinates needed afterwards, in arcsec.
+    low_memory: bool, default 'False'
+        Whether to load the image in low-memory mode (see :func:`extract_image()`).
+    cache_dir: str, default 'None'
+        Directory where the global statistics of the images are cached. 
+        If ``None``, no cache is used.
+    estimator: str, default 'exact'
+        Estimator of the Astropy statistics (see :func:`estimate_astropy_stats()`).
+    n_samples: int, default '100000'
+        Number of pixels used by the 'subsample' and 'tiles' estimators.
+
+    Returns
+    -------
+    data: ndarray
+        Image (or cutout) data/counts.
+    header: ~fits.header
+        Image (or cutout) header.
+    img_wcs: ~astropy.wcs
+        Image (or cutout) WCS.
+    hdu: ~fits.hdu
+        Image (or cutout) Header Data Unit.
+    global_stats: dict
+        SEP and Astropy statistics (with uncertainties) of the whole image.
+    """
+    global_stats = None
+    if cache_dir is not None:
+        cache_key = get_cache_key(file, cache_dir, sigma=3.0, low_memory=low_memory,
+                                  estimator=estimator, n_samples=n_samples)
+        global_stats = load_cached_stats(cache_dir, cache_key)
+    if global_stats is not None:
+        # only the region around the target(s) is needed
+        data, header, img_wcs, hdu = extract_cutout(file, ra, dec, radius, low_memory)
+    else:
+        data, header, img_wcs, hdu = extract_image(file, low_memory)
+        sep_mean, sep_std = get_sep_stats(data)
+        astro_stats, astro_errors = estimate_astropy_stats(data, estimator=estimator, 
+                                                           n_samples=n_samples)
+        global_stats = {'sep_mean':float(sep_mean), 'sep_std':float(sep_std)}
+        for i, stat in enumerate(['mean', 'median', 'std']):
+            global_stats[f'astro_{stat}'] = float(astro_stats[i])
+            global_stats[f'astro_{stat}_err'] = float(astro_errors[i])
+        if cache_dir is not None:
+            save_cached_stats(cache_dir, cache_key, global_stats)
+
+    return data, header, img_wcs, hdu, global_stats
+
 def get_target_stats(data, img_wcs, ra, dec, r_in, r_out):
     """Obtains the background mean, median and std around
     the given coordinates using an annulus.
@@ -132,6 +563,169 @@ def get_target_stats(data, img_wcs, ra, dec, r_in, r_out):
     aperstats = ApertureStats(data, aperture, wcs=img_wcs) 
 
     return aperstats
+
+def get_targets_stats(data, img_wcs, ra, dec, r_in, r_out, percent=90):
+    """Obtains the background percentile and std around many
+    coordinates at once using annuli.
+
+    This is a vectorized version of :func:`get_target_stats()` that gives the 
+    same statistics: all the coordinates are converted to pixels in one go and 
+    the annulus pixels (those with their center inside the annulus) are selected 
+    with a single pixel grid shared by all the targets. As in :func:`check_background()`,
+    the percentile is calculated over the bounding box of the annulus, where the
+    pixels outside the annulus count as zeros.
+
+    Parameters
+    ----------
+    data: ndarray
+        Image data/counts.
+    img_wcs: ~astropy.wcs
+        Image WCS.
+    ra: array-like
+        Right ascensions.
+    dec: array-like
+        Declinations.
+    r_in: float
+        Inner radius of the annulus (in arcsec).
+    r_out: float
+        Outer radius of the annulus (in arcsec).
+    percent: int, default '90'
+        Percentile used for the background around the targets.
+
+    Returns
+    -------
+    target_bkg: ndarray
+        Background percentile of each target.
+    target_std: ndarray
+        Background standard deviation of each target.
+    """
+    coords = SkyCoord(ra=np.atleast_1d(ra), dec=np.atleast_1d(dec), 
+                      unit=(u.degree, u.degree), frame="icrs")
+    x, y = img_wcs.world_to_pixel(coords)
+    # local pixel scale (arcsec/pixel) from a 1-arcsec offset, as in photutils
+    x_offset, y_offset = img_wcs.world_to_pixel(coords.directional_offset_by(0.0, 1 * u.arcsec))
+    pixel_scale = 1 / np.hypot(x_offset - x, y_offset - y)
+    r_in_pix, r_out_pix = r_in / pixel_scale, r_out / pixel_scale
+
+    # bounding boxes of the annuli, as in photutils
+    ixmin = np.floor(x - r_out_pix + 0.5).astype(int)
+    ixmax = np.ceil(x + r_out_pix + 0.5).astype(int)
+    iymin = np.floor(y - r_out_pix + 0.5).astype(int)
+    iymax = np.ceil(y + r_out_pix + 0.5).astype(int)
+    height, width = (iymax - iymin).max(), (ixmax - ixmin).max()
+
+    # pixel grid shared by all the targets: (targets, height, width)
+    grid_y, grid_x = np.mgrid[:height, :width]
+    xx = ixmin[:, None, None] + grid_x[None, :, :]
+    yy = iymin[:, None, None] + grid_y[None, :, :]
+    ny, nx = data.shape
+    bbox_mask = (xx < ixmax[:, None, None]) & (yy < iymax[:, None, None])
+    image_mask = (xx >= 0) & (xx < nx) & (yy >= 0) & (yy < ny)
+    values = data[np.clip(yy, 0, ny - 1), np.clip(xx, 0, nx - 1)]
+
+    dist2 = (xx - x[:, None, None]) ** 2 + (yy - y[:, None, None]) ** 2
+    annulus_mask = ((dist2 >= r_in_pix[:, None, None] ** 2) 
+                    & (dist2 < r_out_pix[:, None, None] ** 2))
+    annulus_values = np.where(annulus_mask & image_mask & np.isfinite(values), values, np.nan)
+    # masked pixels are zeros in ApertureStats.data_cutout.data
+    cutouts = np.where(bbox_mask & image_mask, np.nan_to_num(annulus_values, nan=0.0), np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # targets outside the image
+        target_bkg = np.nanpercentile(cutouts, percent, axis=(1, 2))
+        target_std = np.nanstd(annulus_values, axis=(1, 2))
+
+    return target_bkg, target_std
+
+def sweep_annulus(data, img_wcs, ra, dec, r_in_list, r_out_list, percent=90):
+    """Obtains the background percentile and std around the given coordinates
+    for a grid of annulus radii.
+
+    The pixel distances to the target are calculated and sorted only once, so 
+    each annulus is a contiguous slice of the sorted pixels: the std comes from
+    cumulative sums and the percentile from a selection over the slice. The
+    statistics are the same as those of :func:`get_targets_stats()`.
+
+    Parameters
+    ----------
+    data: ndarray
+        Image data/counts.
+    img_wcs: ~astropy.wcs
+        Image WCS.
+    ra: float
+        Right ascension.
+    dec: float
+        Declination.
+    r_in_list: array-like
+        Inner radii of the annulus (in arcsec).
+    r_out_list: array-like
+        Outer radii of the annulus (in arcsec).
+    percent: int, default '90'
+        Percentile used for the background around the target.
+
+    Returns
+    -------
+    sweep_df: DataFrame
+        Background percentile, std and number of pixels for each combination 
+        of radii (with the inner radius smaller than the outer one).
+    """
+    coords = SkyCoord(ra=ra, dec=dec, unit=(u.degree, u.degree), frame="icrs")
+    x, y = img_wcs.world_to_pixel(coords)
+    # local pixel scale (arcsec/pixel) from a 1-arcsec offset, as in photutils
+    x_offset, y_offset = img_wcs.world_to_pixel(coords.directional_offset_by(0.0, 1 * u.arcsec))
+    pixel_scale = 1 / np.hypot(x_offset - x, y_offset - y)
+
+    # pixels within the largest bounding box, sorted by distance to the target
+    ny, nx = data.shape
+    r_max = np.max(r_out_list) / pixel_scale
+    x0, x1 = max(int(np.floor(x - r_max + 0.5)), 0), min(int(np.ceil(x + r_max + 0.5)), nx)
+    y0, y1 = max(int(np.floor(y - r_max + 0.5)), 0), min(int(np.ceil(y + r_max + 0.5)), ny)
+    # empty box for targets outside the image, which get NaN statistics
+    x1, y1 = max(x1, x0), max(y1, y0)
+    grid_y, grid_x = np.mgrid[y0:y1, x0:x1]
+    dist2 = ((grid_x - x) ** 2 + (grid_y - y) ** 2).ravel()
+    values = data[y0:y1, x0:x1].ravel()
+    order = np.argsort(dist2, kind='stable')
+    dist2, values = dist2[order], values[order]
+
+    # cumulative sums for the std (shifted for numerical stability)
+    finite = np.isfinite(values)
+    shift = np.median(values[finite]) if finite.any() else 0.0
+    shifted = np.where(finite, values - shift, 0.0)
+    cum_n = np.concatenate([[0], np.cumsum(finite)])
+    cum_sum = np.concatenate([[0.0], np.cumsum(shifted)])
+    cum_sum2 = np.concatenate([[0.0], np.cumsum(shifted ** 2)])
+
+    sweep_dict = {'r_in':[], 'r_out':[], 'annulus_bkg':[], 'annulus_std':[], 'n_pixels':[]}
+    for r_out in np.unique(r_out_list):
+        r_out_pix = r_out / pixel_scale
+        hi = np.searchsorted(dist2, r_out_pix ** 2, side='left')
+        # pixels in the bounding box of this annulus (as in photutils)
+        box_x0, box_x1 = max(int(np.floor(x - r_out_pix + 0.5)), 0), min(int(np.ceil(x + r_out_pix + 0.5)), nx)
+        box_y0, box_y1 = max(int(np.floor(y - r_out_pix + 0.5)), 0), min(int(np.ceil(y + r_out_pix + 0.5)), ny)
+        n_box = max(box_x1 - box_x0, 0) * max(box_y1 - box_y0, 0)
+        for r_in in np.unique(r_in_list):
+            if r_in >= r_out:
+                continue
+            lo = np.searchsorted(dist2, (r_in / pixel_scale) ** 2, side='left')
+            n_pix = cum_n[hi] - cum_n[lo]
+            if n_pix > 0:
+                mean = (cum_sum[hi] - cum_sum[lo]) / n_pix
+                std = np.sqrt(max((cum_sum2[hi] - cum_sum2[lo]) / n_pix - mean ** 2, 0.0))
+                # the other pixels of the bounding box count as zeros
+                annulus_values = values[lo:hi][finite[lo:hi]]
+                box_values = np.concatenate([annulus_values, np.zeros(n_box - n_pix)])
+                bkg = np.percentile(box_values, percent)
+            else:
+                std = bkg = np.nan
+
+            sweep_dict['r_in'].append(r_in)
+            sweep_dict['r_out'].append(r_out)
+            sweep_dict['annulus_bkg'].append(bkg)
+            sweep_dict['annulus_std'].append(std)
+            sweep_dict['n_pixels'].append(n_pix)
+    sweep_df = pd.DataFrame(sweep_dict)
+
+    return sweep_df
             
 def plot_target(
     hdu,
@@ -233,8 +827,178 @@ def plot_target(
         plt.show()
     else:
         plt.ioff()
+        plt.close(figure)
     
-def check_background(file, ra, dec, r_in=3, r_out=6, method='mean', percent=90, size=1.0, show_plot=True, dest_dir=""):
+def plot_target_fast(data, img_wcs, ra, dec, r_in, r_out, size=1.0, outfile=None, 
+                     pmin=0.25, pmax=99.75, asinh_a=0.1):
+    """Saves a thumbnail of the region around the target with the annulus,
+    without any axes or labels.
+
+    This is a headless alternative to :func:`plot_target()` for batch runs: the
+    image is cropped, stretched with an arcsinh function and overlaid with the 
+    annulus using NumPy only, and then written directly as an image file.
+
+    Parameters
+    ----------
+    data: ndarray
+        Image data/counts.
+    img_wcs: ~astropy.wcs
+        Image WCS.
+    ra: float
+        Right ascension, in degrees.
+    dec: float
+        Declination, in degrees.
+    r_in: float
+        Inner radius of the annulus (in arcsec).
+    r_out: float
+        Outer radius of the annulus (in arcsec).
+    size: float, default '1.0'
+        Size of the image to be plotted, in arcminutes (as in :func:`plot_target()`).
+    outfile: str, default 'None'
+        Output file name.
+    pmin: float, default '0.25'
+        Lower percentile used for the stretch.
+    pmax: float, default '99.75'
+        Upper percentile used for the stretch.
+    asinh_a: float, default '0.1'
+        Softening parameter of the arcsinh stretch.
+
+    Returns
+    -------
+    rgb: ndarray
+        Thumbnail RGB values.
+    """
+    coords = SkyCoord(ra=ra, dec=dec, unit=(u.degree, u.degree), frame="icrs")
+    x, y = img_wcs.world_to_pixel(coords)
+    pixel_scale = np.mean(proj_plane_pixel_scales(img_wcs)) * 3600  # arcsec/pixel
+
+    # crop
+    half_size = int(np.ceil(size * 60 / pixel_scale))
+    ny, nx = data.shape
+    x0, x1 = max(int(np.round(x)) - half_size, 0), min(int(np.round(x)) + half_size + 1, nx)
+    y0, y1 = max(int(np.round(y)) - half_size, 0), min(int(np.round(y)) + half_size + 1, ny)
+    if x1 <= x0 or y1 <= y0:
+        # target outside the image: blank thumbnail
+        rgb = np.zeros((2 * half_size + 1, 2 * half_size + 1, 3), dtype=np.uint8)
+        if outfile is not None:
+            matplotlib.image.imsave(outfile, rgb)
+        return rgb
+    cutout = data[y0:y1, x0:x1]
+
+    # arcsinh stretch
+    vmin, vmax = np.nanpercentile(cutout, [pmin, pmax])
+    scaled = np.clip((cutout - vmin) / (vmax - vmin), 0, 1)
+    scaled = np.nan_to_num(np.arcsinh(scaled / asinh_a) / np.arcsinh(1 / asinh_a))
+    rgb = np.repeat((scaled * 255).astype(np.uint8)[:, :, None], 3, axis=2)
+
+    # annulus overlay
+    grid_y, grid_x = np.mgrid[y0:y1, x0:x1]
+    dist = np.hypot(grid_x - x, grid_y - y) * pixel_scale  # arcsec
+    width = max(1, cutout.shape[0] // 250) * pixel_scale
+    ring_mask = (np.abs(dist - r_in) < width) | (np.abs(dist - r_out) < width)
+    rgb[ring_mask] = [255, 0, 0]
+
+    rgb = rgb[::-1]  # origin at the bottom, as in aplpy
+    if outfile is not None:
+        matplotlib.image.imsave(outfile, rgb)
+
+    return rgb
+
+def connect_store(store):
+    """Connects to the results store (an SQLite database), creating it if needed.
+
+    The database uses write-ahead logging and waits for locks, so several
+    processes can append results at the same time.
+
+    Parameters
+    ----------
+    store: str
+        Database file name.
+
+    Returns
+    -------
+    conn: ~sqlite3.Connection
+        Database connection.
+    """
+    conn = sqlite3.connect(store, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    columns = ', '.join(f'{column} {sql_type}' for column, sql_type in STORE_COLUMNS.items())
+    conn.execute(f'CREATE TABLE IF NOT EXISTS background ({columns})')
+    for column in ['file', 'name', 'date_obs']:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{column} ON background ({column})')
+    conn.commit()
+
+    return conn
+
+def save_to_store(out_df, store):
+    """Appends background statistics to the results store.
+
+    Parameters
+    ----------
+    out_df: DataFrame
+        Background statistics, as returned by :func:`check_background()`.
+    store: str
+        Database file name.
+    """
+    columns = [column for column in STORE_COLUMNS if column in out_df.columns]
+    rows = out_df[columns].astype(object).where(out_df[columns].notna(), None).values.tolist()
+    placeholders = ', '.join('?' * len(columns))
+    conn = connect_store(store)
+    try:
+        with conn:  # single transaction
+            conn.executemany(f'INSERT INTO background ({", ".join(columns)}) VALUES ({placeholders})', 
+                             rows)
+    finally:
+        conn.close()
+
+def query_store(store, name=None, file=None, min_diff=None, diff_column='astro_diff'):
+    """Queries the results store.
+
+    For instance, ``query_store(store, name='2024abc', min_diff=1.0)`` gives 
+    all the frames of a target that might need templates.
+
+    Parameters
+    ----------
+    store: str
+        Database file name.
+    name: str, default 'None'
+        Target name.
+    file: str, default 'None'
+        FITS file name.
+    min_diff: float, default 'None'
+        Minimum difference in background, in sigmas.
+    diff_column: str, default 'astro_diff'
+        Difference used with ``min_diff``: either 'astro_diff' or 'sep_diff'.
+
+    Returns
+    -------
+    results_df: DataFrame
+        Matching rows, sorted by observation date.
+    """
+    assert diff_column in ['astro_diff', 'sep_diff'], "Not a valid difference column!"
+    conditions, params = [], []
+    for column, value in [('name', name), ('file', file)]:
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    if min_diff is not None:
+        conditions.append(f'{diff_column} >= ?')
+        params.append(min_diff)
+    where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+
+    conn = connect_store(store)
+    try:
+        results_df = pd.read_sql_query(f'SELECT * FROM background{where} ORDER BY date_obs', 
+                                       conn, params=params)
+    finally:
+        conn.close()
+
+    return results_df
+
+def check_background(file, ra, dec, r_in=3, r_out=6, method='mean', percent=90, size=1.0, show_plot=True, dest_dir="",
+                     save_output=True, save_plot=True, low_memory=False, cache_dir=None, 
+                     estimator='exact', n_samples=100000, renderer='aplpy', name=None, store=None,
+                     plot_labels=None):
     """Calculates the difference, in sigmas, between an image global
     background and the background around the given coordinates.
     
@@ -246,10 +1010,10 @@ def check_background(file, ra, dec, r_in=3, r_out=6, method='mean', percent=90,
     ----------
     file: str
         Name of the FITS file.
-    ra: float
-        Right ascension.
-    dec: float
-        Declination.
+    ra: float or array-like
+        Right ascension(s). Several targets in the same image are measured at once.
+    dec: float or array-like
+        Declination(s).
     r_in: float, default '3'
         Inner radius of the annulus (in arcsec).
     r_out: float, default '6'
@@ -265,17 +1029,50 @@ def check_background(file, ra, dec, r_in=3, r_out=6, method='mean', percent=90,
         Whether to show the image with the annulus used.
     dest_dir: str, default '"'
         Where to save the output files.
+    save_output: bool, default 'True'
+        Whether to save the output statistics into a CSV file.
+    save_plot: bool, default 'True'
+        Whether to plot the image with the annulus. The plot is
+        saved as a JPG file even if ``show_plot`` is ``False``.
+    low_memory: bool, default 'False'
+        Whether to load the image in low-memory mode (see :func:`extract_image()`).
+    cache_dir: str, default 'None'
+        Directory where the global statistics of the images are cached. 
+        If ``None``, no cache is used. When the statistics are found in
+        the cache, only the region around the target is read from disk.
+    estimator: str, default 'exact'
+        Estimator of the Astropy statistics: 'exact', 'subsample' or 'tiles'
+        (see :func:`estimate_astropy_stats()`).
+    n_samples: int, default '100000'
+        Number of pixels used by the 'subsample' and 'tiles' estimators.
+    renderer: str, default 'aplpy'
+        Either 'aplpy' (:func:`plot_target()`) or 'fast' (:func:`plot_target_fast()`).
+        The latter saves a thumbnail without labels and never shows the plot.
+    name: str or array-like, default 'None'
+        Name of the target(s).
+    store: str, default 'None'
+        SQLite database where the results are appended (see :func:`save_to_store()`).
+    plot_labels: array-like, default 'None'
+        Labels appended to the plot names, one per target (e.g. the manifest rows
+        in batch mode). By default, the target number is used with several targets.
+
+    Returns
+    -------
+    out_df: DataFrame
+        Background statistics, with one row per target.
     """
-    data, header, img_wcs, hdu = extract_image(file)
-    
     # sep and astropy background statistics
-    sep_mean, sep_std = get_sep_stats(data)
-    astro_mean, astro_median, astro_std = get_astropy_stats(data)
-    # target's background statistics using an annulus
-    aperstats = get_target_stats(data, img_wcs, ra, dec, r_in, r_out)
-    aperture = aperstats.aperture
-    target_bkg = np.percentile(aperstats.data_cutout.data, percent)
-    target_std = aperstats.std  # not used as it is not a good statistic
+    radius = max(r_out, size * 60) if save_plot else r_out  # aplpy recenters with a radius
+    data, header, img_wcs, hdu, global_stats = load_image_and_stats(file, ra, dec, radius, low_memory, 
+                                                                    cache_dir, estimator, n_samples)
+    sep_mean, sep_std = global_stats['sep_mean'], global_stats['sep_std']
+    astro_mean, astro_median = global_stats['astro_mean'], global_stats['astro_median']
+    astro_std = global_stats['astro_std']
+    astro_errors = [global_stats.get(f'astro_{stat}_err', 0.0) for stat in ['mean', 'median', 'std']]
+    # targets' background statistics using annuli
+    ra, dec = np.atleast_1d(ra).astype(float), np.atleast_1d(dec).astype(float)
+    target_bkg, target_std = get_targets_stats(data, img_wcs, ra, dec, r_in, r_out, percent)
+    # the std is not used as it is not a good statistic
     
     assert method in ['mean', 'median'], "Not a valid method!"
     
@@ -286,47 +1083,546 @@ def check_background(file, ra, dec, r_in=3, r_out=6, method='mean', percent=90,
     elif method=='median':
         astro_diff = np.abs(target_bkg-astro_median)/astro_std
      
-    # save output into a file
-    out_dict = {'file':[file],
-                'ra':[ra],
-                'dec':[dec],
-                'r_in':[r_in],
-                'r_out':[r_out],
-                'method':[method],
-                'sep_diff':[sep_diff],
-                'astro_diff':[astro_diff],
-                'sep_mean':[sep_mean],
-                'sep_std':[sep_std],
-                'astro_mean':[astro_mean],
-                'astro_median':[astro_median],
-                'astro_std':[astro_std],
-                'annulus_bkg':[target_bkg],
-                'annulus_std':[target_std],
-                'annulus_percent':[percent]
+    # save output into a file (one row per target)
+    out_dict = {'file':file,
+                'name':name,
+                'date_obs':header.get('DATE-OBS'),
+                'run_date':Time.now().isot,
+                'ra':ra,
+                'dec':dec,
+                'r_in':r_in,
+                'r_out':r_out,
+                'method':method,
+                'sep_diff':sep_diff,
+                'astro_diff':astro_diff,
+                'sep_mean':sep_mean,
+                'sep_std':sep_std,
+                'astro_mean':astro_mean,
+                'astro_median':astro_median,
+                'astro_std':astro_std,
+                'astro_mean_err':astro_errors[0],
+                'astro_median_err':astro_errors[1],
+                'astro_std_err':astro_errors[2],
+                'astro_estimator':estimator,
+                'annulus_bkg':target_bkg,
+                'annulus_std':target_std,
+                'annulus_percent':percent
                }
+    out_df = pd.DataFrame(out_dict)
     
-    df = pd.DataFrame(out_dict)
-    outfile = os.path.basename(file).replace('.fits', '')
+    outfile = os.path.basename(file).replace('.fz', '').replace('.fits', '')
     outfile = os.path.join(dest_dir, 'bkg_' + outfile + '.csv')
-    df.to_csv(outfile, index=False)
-
-    print(f'SEP: {np.round(sep_diff, 2)} sigmas')
-    print(f'ASTROPY: {np.round(astro_diff, 2)} sigmas')
-
-    # plotting    
-    info_dict = {'sep':[sep_mean, sep_std],
-                    'astro':[astro_mean, astro_median, astro_std],
-                    'target':[target_bkg, target_std, percent],
-                    'sep_diff':sep_diff,
-                    'astro_diff':astro_diff,
-                }
-    outfile = outfile.replace('.csv', '.jpg')
-    plot_target(hdu, ra, dec, aperture, size, info_dict, show_plot, outfile)
+    if save_output:
+        out_df.to_csv(outfile, index=False)
+    if store is not None:
+        save_to_store(out_df, store)
+
+    n_targets = len(ra)
+    for i in range(n_targets):
+        prefix = '' if n_targets == 1 else f'Target {i} ({ra[i]}, {dec[i]}) - '
+        print(f'{prefix}SEP: {np.round(float(sep_diff[i]), 2)} sigmas')
+        if estimator == 'exact':
+            print(f'{prefix}ASTROPY: {np.round(float(astro_diff[i]), 2)} sigmas')
+        else:
+            # uncertainty from the estimated background level only
+            level_err = astro_errors[0] if method == 'mean' else astro_errors[1]
+            astro_diff_err = float(level_err / astro_std)
+            print(f'{prefix}ASTROPY: {np.round(float(astro_diff[i]), 2)} +/- {np.round(astro_diff_err, 2)} '
+                  f'sigmas ({estimator})')
+
+    # plotting (one plot per target)
+    if save_plot:
+        for i in range(n_targets):
+            if plot_labels is not None:
+                suffix = f'_{plot_labels[i]}.jpg'
+            else:
+                suffix = '.jpg' if n_targets == 1 else f'_{i}.jpg'
+            if renderer == 'fast':
+                plot_target_fast(data, img_wcs, ra[i], dec[i], r_in, r_out, size, 
+                                 outfile.replace('.csv', suffix))
+                continue
+            info_dict = {'sep':[sep_mean, sep_std],
+                            'astro':[astro_mean, astro_median, astro_std],
+                            'target':[target_bkg[i], target_std[i], percent],
+                            'sep_diff':sep_diff[i],
+                            'astro_diff':astro_diff[i],
+                        }
+            coords = SkyCoord(ra=ra[i], dec=dec[i], unit=(u.degree, u.degree), frame="icrs")
+            aperture = SkyCircularAnnulus(coords, r_in=r_in * u.arcsec, r_out=r_out * u.arcsec)
+            plot_target(hdu, ra[i], dec[i], aperture, size, info_dict, show_plot, 
+                        outfile.replace('.csv', suffix))
+
+    return out_df
+
+def check_background_sweep(file, ra, dec, r_in_list, r_out_list, method='mean', percent=90, dest_dir="",
+                           low_memory=False, cache_dir=None, estimator='exact', n_samples=100000):
+    """Calculates the difference, in sigmas, between an image global background 
+    and the background around the given coordinates for a grid of annulus radii.
+
+    This helps choosing the radii, at the cost of a single run
+    of :func:`check_background()` (see :func:`sweep_annulus()`).
+
+    Parameters
+    ----------
+    file: str
+        Name of the FITS file.
+    ra: float
+        Right ascension.
+    dec: float
+        Declination.
+    r_in_list: array-like
+        Inner radii of the annulus (in arcsec).
+    r_out_list: array-like
+        Outer radii of the annulus (in arcsec).
+    method: str, default 'mean'
+        Method used to estimate the difference in background.
+        Either 'mean' or 'median'. SEP only uses 'mean'.
+    percent: int, default '90'
+        Percentile used for the background around the target.
+    dest_dir: str, default '"'
+        Where to save the output file.
+    low_memory: bool, default 'False'
+        Whether to load the image in low-memory mode (see :func:`extract_image()`).
+    cache_dir: str, default 'None'
+        Directory where the global statistics of the images are cached. 
+        If ``None``, no cache is used.
+    estimator: str, default 'exact'
+        Estimator of the Astropy statistics (see :func:`estimate_astropy_stats()`).
+    n_samples: int, default '100000'
+        Number of pixels used by the 'subsample' and 'tiles' estimators.
+
+    Returns
+    -------
+    sweep_df: DataFrame
+        Background statistics, with one row per combination of radii.
+    """
+    assert method in ['mean', 'median'], "Not a valid method!"
+    data, header, img_wcs, hdu, global_stats = load_image_and_stats(file, ra, dec, np.max(r_out_list), 
+                                                                    low_memory, cache_dir, 
+                                                                    estimator, n_samples)
+    sweep_df = sweep_annulus(data, img_wcs, ra, dec, r_in_list, r_out_list, percent)
+
+    target_bkg = sweep_df.annulus_bkg.values
+    astro_level = global_stats['astro_mean'] if method == 'mean' else global_stats['astro_median']
+    sweep_df['sep_diff'] = np.abs(target_bkg - global_stats['sep_mean']) / global_stats['sep_std']
+    sweep_df['astro_diff'] = np.abs(target_bkg - astro_level) / global_stats['astro_std']
+    sweep_df.insert(0, 'file', file)
+    sweep_df.insert(1, 'ra', ra)
+    sweep_df.insert(2, 'dec', dec)
+    sweep_df['method'] = method
+    sweep_df['annulus_percent'] = percent
+
+    outfile = os.path.basename(file).replace('.fz', '').replace('.fits', '')
+    outfile = os.path.join(dest_dir, 'bkg_sweep_' + outfile + '.csv')
+    sweep_df.to_csv(outfile, index=False)
+    print(sweep_df[['r_in', 'r_out', 'n_pixels', 'sep_diff', 'astro_diff']].to_string(index=False, 
+                                                                                     float_format='%.2f'))
+
+    return sweep_df
+
+def _init_batch_worker():
+    """Initialises a batch worker with a non-interactive backend.
+
+    Interruptions (Ctrl+C) are left to the main process.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    plt.switch_backend('Agg')
+
+def _batch_worker(kwargs):
+    """Runs :func:`check_background()` for all the targets of a file,
+    catching any error so a bad frame does not stop the batch.
+    """
+    try:
+        with suppress_stdout():
+            out_df = check_background(**kwargs)
+        out_df['status'] = 'ok'
+    except Exception as exc:
+        out_df = pd.DataFrame({key:kwargs[key] for key in ['file', 'name', 'ra', 'dec', 'r_in', 'r_out', 'method']})
+        out_df['annulus_percent'] = kwargs['percent']
+        out_df['status'] = f'error: {exc}'
+
+    return out_df
+
+def check_background_batch(manifest, r_in=3, r_out=6, method='mean', percent=90, size=1.0, 
+                           dest_dir="", outfile="bkg_batch.csv", n_workers=None, save_plot=False, 
+                           low_memory=False, cache_dir=None, estimator='exact', n_samples=100000,
+                           renderer='fast', store=None):
+    """Runs :func:`check_background()` over many files and targets
+    using a pool of processes.
+
+    The manifest is a CSV file with, at least, the ``file``, ``ra`` and ``dec``
+    columns, and optionally the target ``name``. The ``r_in``, ``r_out``, ``method``, ``percent`` and ``size`` columns
+    are optional and, if given, override the default values per row. The targets
+    of the same file (with the same parameters) are measured together. The output
+    keeps the order of the manifest, and the plots are labelled with the manifest
+    row (e.g. ``bkg_<file>_<row>.jpg``).
+
+    Parameters
+    ----------
+    manifest: str or DataFrame
+        Manifest file name or table.
+    r_in: float, default '3'
+        Inner radius of the annulus (in arcsec).
+    r_out: float, default '6'
+        Outer radius of the annulus (in arcsec).
+    method: str, default 'mean'
+        Method used to estimate the difference in background.
+        Either 'mean' or 'median'. SEP only uses 'mean'.
+    percent: int, default '90'
+        Percentile used for the background around the target.
+    size: float, default '1.0'
+        Size of the image to be plotted, in arcminutes.
+    dest_dir: str, default '"'
+        Where to save the output files.
+    outfile: str, default 'bkg_batch.csv'
+        Name of the consolidated output file.
+    n_workers: int, default 'None'
+        Number of processes. By default, the number of CPUs is used.
+    save_plot: bool, default 'False'
+        Whether to save a plot for each row of the manifest.
+    low_memory: bool, default 'False'
+        Whether to load the images in low-memory mode (see :func:`extract_image()`).
+    cache_dir: str, default 'None'
+        Directory where the global statistics of the images are cached. 
+        If ``None``, no cache is used.
+    estimator: str, default 'exact'
+        Estimator of the Astropy statistics: 'exact', 'subsample' or 'tiles'
+        (see :func:`estimate_astropy_stats()`).
+    n_samples: int, default '100000'
+        Number of pixels used by the 'subsample' and 'tiles' estimators.
+    renderer: str, default 'fast'
+        Either 'aplpy' (:func:`plot_target()`) or 'fast' (:func:`plot_target_fast()`).
+    store: str, default 'None'
+        SQLite database where the results are appended (see :func:`save_to_store()`).
+
+    Returns
+    -------
+    results_df: DataFrame
+        Background statistics, with one row per row in the manifest.
+    """
+    if isinstance(manifest, str):
+        manifest_df = pd.read_csv(manifest)
+    else:
+        manifest_df = manifest
+    for column in ['file', 'ra', 'dec']:
+        assert column in manifest_df.columns, f"Missing '{column}' column in the manifest!"
+
+    defaults = {'r_in':r_in, 'r_out':r_out, 'method':method, 'percent':percent, 'size':size}
+    manifest_df = manifest_df.reset_index(drop=True)  # row numbers
+    for key, value in defaults.items():
+        if key in manifest_df.columns:
+            manifest_df[key] = manifest_df[key].fillna(value)
+        else:
+            manifest_df[key] = value
+
+    # one task per file and set of parameters
+    tasks = []
+    group_keys = ['file'] + list(defaults.keys())
+    for group_values, group_df in manifest_df.groupby(group_keys, sort=False):
+        kwargs = dict(zip(group_keys, group_values))
+        names = group_df.name.values if 'name' in group_df.columns else None
+        kwargs.update({'ra':group_df.ra.values.astype(float), 'dec':group_df.dec.values.astype(float), 
+                       'name':names, 
+                       'show_plot':False, 'dest_dir':dest_dir, 
+                       'save_output':False, 'save_plot':save_plot, 'low_memory':low_memory, 
+                       'cache_dir':cache_dir, 'estimator':estimator, 'n_samples':n_samples,
+                       'renderer':renderer, 'plot_labels':group_df.index.values})
+        tasks.append(kwargs)
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    # a few tasks per chunk to reduce inter-process overhead
+    chunksize = max(1, len(tasks) // (4 * n_workers))
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_batch_worker) as executor:
+        results = list(executor.map(_batch_worker, tasks, chunksize=chunksize))
+
+    # back to the order of the manifest
+    rows = np.concatenate([kwargs['plot_labels'] for kwargs in tasks])
+    results_df = pd.concat(results, ignore_index=True)
+    results_df = results_df.iloc[np.argsort(rows, kind='stable')].reset_index(drop=True)
+    results_df.to_csv(os.path.join(dest_dir, outfile), index=False)
+    if store is not None:
+        save_to_store(results_df, store)
+    n_failed = (results_df.status != 'ok').sum()
+    print(f'{len(results_df) - n_failed}/{len(results_df)} rows processed successfully')
+
+    return results_df
+
+def get_watch_targets(file, targets_df=None):
+    """Obtains the coordinates of the targets of a new image.
+
+    If a target list is given, the target matching the ``OBJECT`` keyword
+    of the header is used or, if none matches, all the targets inside
+    the image footprint. Otherwise, the ``RA`` and ``DEC`` header keywords
+    (or ``OBJRA`` and ``OBJDEC``) are used.
+
+    Parameters
+    ----------
+    file: str
+        Name of the FITS file.
+    targets_df: DataFrame, default 'None'
+        Target list with ``name``, ``ra`` and ``dec`` columns.
+
+    Returns
+    -------
+    ra: ndarray
+        Right ascensions.
+    dec: ndarray
+        Declinations.
+    names: ndarray or None
+        Target names.
+    """
+    with fits.open(file) as hdul:
+        header = get_image_hdu(hdul).header.copy()
+
+    if targets_df is not None:
+        match_df = targets_df[targets_df.name.astype(str) == str(header.get('OBJECT', '')).strip()]
+        if len(match_df) == 0:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", AstropyWarning)
+                img_wcs = wcs.WCS(header, naxis=2)
+            coords = SkyCoord(ra=targets_df.ra.values, dec=targets_df.dec.values, 
+                              unit=(u.degree, u.degree), frame="icrs")
+            match_df = targets_df[img_wcs.footprint_contains(coords)]
+        return match_df.ra.values, match_df.dec.values, match_df.name.values
+
+    for ra_key, dec_key in [('RA', 'DEC'), ('OBJRA', 'OBJDEC')]:
+        if ra_key in header and dec_key in header:
+            ra, dec = header[ra_key], header[dec_key]
+            # sexagesimal coordinates are assumed to be in hours and degrees
+            unit = (u.hourangle, u.degree) if isinstance(ra, str) and ':' in ra else (u.degree, u.degree)
+            coords = SkyCoord(ra=ra, dec=dec, unit=unit, frame="icrs")
+            return np.array([coords.ra.degree]), np.array([coords.dec.degree]), None
+    raise ValueError(f"No target coordinates found for {file}!")
+
+def _watch_worker(file, targets_df, kwargs):
+    """Runs :func:`check_background()` for a new image found in watch mode.
+    """
+    try:
+        ra, dec, names = get_watch_targets(file, targets_df)
+        if len(ra) == 0:
+            raise ValueError("No targets inside the image")
+        with suppress_stdout():
+            out_df = check_background(file, ra, dec, name=names, **kwargs)
+        out_df['status'] = 'ok'
+    except Exception as exc:
+        out_df = pd.DataFrame({'file':[file], 'status':[f'error: {exc}']})
+
+    return out_df
+
+def watch_directory(directory, targets=None, poll_interval=5.0, n_workers=None, max_pending=None, 
+                    dest_dir="", outfile="bkg_batch.csv", store=None, skip_existing=False, 
+                    duration=None, **kwargs):
+    """Watches a directory and runs :func:`check_background()` on new FITS files
+    as they arrive, appending the results to the output as they finish.
+
+    A file is processed once its size and modification time are stable between
+    two consecutive polls (i.e. it is completely written). The targets of each 
+    image are found with :func:`get_watch_targets()`.
+
+    Parameters
+    ----------
+    directory: str
+        Directory to watch.
+    targets: str or DataFrame, default 'None'
+        Target list (file name or table) with ``name``, ``ra`` and ``dec`` columns.
+        If not given, the coordinates are taken from the image header.
+    poll_interval: float, default '5.0'
+        Time between polls, in seconds.
+    n_workers: int, default 'None'
+        Number of processes. By default, the number of CPUs is used.
+    max_pending: int, default 'None'
+        Maximum number of images queued or in process. By default, twice the
+        number of processes. New files wait in the directory until there is room.
+    dest_dir: str, default '"'
+        Where to save the output files.
+    outfile: str, default 'bkg_batch.csv'
+        Name of the output file where the results are appended.
+    store: str, default 'None'
+        SQLite database where the results are appended (see :func:`save_to_store()`).
+    skip_existing: bool, default 'False'
+        Whether to skip the files already in the directory when the watch starts.
+    duration: float, default 'None'
+        Stop watching after this many seconds. By default, watch until interrupted.
+    kwargs: dict
+        Other :func:`check_background()` parameters.
+    """
+    if isinstance(targets, str):
+        targets_df = pd.read_csv(targets)
+    else:
+        targets_df = targets
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if max_pending is None:
+        max_pending = 2 * n_workers
+    kwargs.update({'show_plot':False, 'save_output':False, 'dest_dir':dest_dir})
+    kwargs.setdefault('renderer', 'fast')
+    kwargs.setdefault('save_plot', False)
+    output_file = os.path.join(dest_dir, outfile)
+
+    def list_fits():
+        files = {}
+        for entry in os.scandir(directory):
+            if not entry.name.endswith(('.fits', '.fit', '.fits.fz')):
+                continue
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                pass  # removed or renamed since the directory was listed
+        return files
+
+    def write_results(out_df):
+        out_df = out_df.reindex(columns=list(STORE_COLUMNS))
+        out_df.to_csv(output_file, mode='a', header=not os.path.isfile(output_file), index=False)
+        if store is not None:
+            save_to_store(out_df, store)
+        for _, row in out_df.iterrows():
+            print(f"{row.file} ({row['name']}): {row.status}, astro_diff={row.astro_diff:.2f}")
+
+    done = set(list_fits()) if skip_existing else set()
+    previous = {}  # file sizes and modification times in the last poll
+    pending = set()
+    start = time.time()
+    print(f'Watching {directory} (Ctrl+C to stop)...')
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_batch_worker) as executor:
+        try:
+            while duration is None or time.time() - start < duration:
+                current = list_fits()
+                for file, file_stat in sorted(current.items()):
+                    if len(pending) >= max_pending:
+                        break
+                    if file not in done and previous.get(file) == file_stat:
+                        pending.add(executor.submit(_watch_worker, file, targets_df, kwargs))
+                        done.add(file)
+                previous = current
+
+                # write the results as they finish until the next poll
+                deadline = time.time() + poll_interval
+                while pending and time.time() < deadline:
+                    finished, pending = wait(pending, timeout=deadline - time.time(), 
+                                             return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        write_results(future.result())
+                time.sleep(max(0.0, deadline - time.time()))
+        except KeyboardInterrupt:
+            print('Stopping...')
+        for future in as_completed(pending):
+            write_results(future.result())
+
+def handle_request(request, defaults=None):
+    """Runs :func:`check_background()` for a single server request.
+
+    Parameters
+    ----------
+    request: dict
+        Request with the ``file``, ``ra`` and ``dec`` keys, and optionally an ``id``
+        (echoed in the response) and any other :func:`check_background()` parameter.
+    defaults: dict, default 'None'
+        Default :func:`check_background()` parameters.
+
+    Returns
+    -------
+    response: dict
+        Response with the ``status`` ('ok' or 'error') and the ``results``
+        (one dictionary per target) or the ``error`` message.
+    """
+    kwargs = {'show_plot':False, 'save_output':False, 'save_plot':False, 'renderer':'fast'}
+    if defaults is not None:
+        kwargs.update(defaults)
+    if not isinstance(request, dict):
+        return {'id':None, 'status':'error',
+                'error':f'Invalid request: expected a JSON object, got {type(request).__name__}'}
+    request = dict(request)
+    response = {'id':request.pop('id', None)}
+    kwargs.update(request)
+    try:
+        with suppress_stdout():
+            out_df = check_background(**kwargs)
+        response['status'] = 'ok'
+        response['results'] = json.loads(out_df.to_json(orient='records'))
+    except Exception as exc:
+        response['status'] = 'error'
+        response['error'] = f'{type(exc).__name__}: {exc}'
+
+    return response
+
+def serve_stream(in_stream, out_stream, defaults=None):
+    """Answers JSON-lines requests from a stream, one response line per request.
+
+    Parameters
+    ----------
+    in_stream: file-like
+        Stream with one JSON request per line (see :func:`handle_request()`).
+    out_stream: file-like
+        Stream where the JSON responses are written.
+    defaults: dict, default 'None'
+        Default :func:`check_background()` parameters.
+    """
+    for line in in_stream:
+        binary = isinstance(line, bytes)  # e.g. socket streams
+        if binary:
+            line = line.decode()
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as exc:
+            response = {'id':None, 'status':'error', 'error':f'Invalid JSON: {exc}'}
+        else:
+            # a bad request never stops the server
+            try:
+                response = handle_request(request, defaults)
+            except Exception as exc:
+                response = {'id':None, 'status':'error', 'error':f'{type(exc).__name__}: {exc}'}
+        response_line = json.dumps(response) + '\n'
+        if binary:
+            response_line = response_line.encode()
+        out_stream.write(response_line)
+        out_stream.flush()
+
+def serve(socket_path=None, defaults=None):
+    """Keeps the (slow to import) modules loaded and answers
+    JSON-lines requests, so each request only costs the measurement.
+
+    Requests are read from the standard input, or from clients of a
+    Unix socket, one at a time. For example:
+    ``{"id": 1, "file": "image.fits", "ra": 150.1, "dec": 2.2, "r_out": 8}``
+
+    Parameters
+    ----------
+    socket_path: str, default 'None'
+        Path of the Unix socket. If ``None``, the standard input and output are used.
+    defaults: dict, default 'None'
+        Default :func:`check_background()` parameters.
+    """
+    plt.switch_backend('Agg')
+    if socket_path is None:
+        serve_stream(sys.stdin, sys.stdout, defaults)
+        return
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            serve_stream(self.rfile, self.wfile, defaults)
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)  # stale socket from a previous server
+    with socketserver.UnixStreamServer(socket_path, RequestHandler) as server:
+        print(f'Listening on {socket_path}', file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
         
         
 def main(args=None):
     description = f"Checks image background to identify the need of templates for image subtraction"
-    usage = "check_background file ra dec [options]"
+    usage = ("check_background file ra dec [options] | check_background file --targets TARGETS [options] | "
+             "check_background --manifest MANIFEST [options] | check_background --serve [options] | "
+             "check_background --watch DIRECTORY [options]")
     
     if not args:
         args = sys.argv[1:] if sys.argv[1:] else ["--help"]
@@ -337,14 +1633,17 @@ def main(args=None):
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter
                                      )
     parser.add_argument("file",
+                        nargs="?",
                         type=str,
                         help="Name of the FITS file."
                         )
     parser.add_argument("ra",
+                        nargs="?",
                         type=float,
                         help="Right ascension."
                         )
     parser.add_argument("dec",
+                        nargs="?",
                         type=float,
                         help="Declination."
                         )
@@ -404,9 +1703,182 @@ def main(args=None):
                         help="Where to store the output files."
                         )
     
+    parser.add_argument("--manifest",
+                        dest="manifest",
+                        action="store",
+                        type=str,
+                        help=("CSV file with 'file', 'ra' and 'dec' columns (optionally, also "
+                              "'r_in', 'r_out', 'method', 'percent' and 'size') for batch mode.")
+                        )
+    parser.add_argument("-n",
+                        "--n_workers",
+                        dest="n_workers",
+                        action="store",
+                        type=int,
+                        help="Number of processes used in batch mode. By default, the number of CPUs."
+                        )
+    parser.add_argument("-o",
+                        "--outfile",
+                        dest="outfile",
+                        action="store",
+                        default="bkg_batch.csv",
+                        type=str,
+                        help="Name of the consolidated output file in batch and watch modes."
+                        )
+    parser.add_argument("--save_plot",
+                        dest="save_plot",
+                        action="store",
+                        default=0,
+                        choices=[0, 1],
+                        type=int,
+                        help="Whether to save a plot per image in batch and watch modes."
+                        )
+    parser.add_argument("--low_memory",
+                        dest="low_memory",
+                        action="store",
+                        default=0,
+                        choices=[0, 1],
+                        type=int,
+                        help=("Whether to memory-map the image and keep it in single precision "
+                              "when double precision is not needed.")
+                        )
+    parser.add_argument("--cache_dir",
+                        dest="cache_dir",
+                        action="store",
+                        type=str,
+                        help=("Directory where the global background statistics of the images are cached, "
+                              "so re-runs with other coordinates or annulus only measure the annulus.")
+                        )
+    parser.add_argument("-e",
+                        "--estimator",
+                        dest="estimator",
+                        action="store",
+                        default="exact",
+                        choices=["exact", "subsample", "tiles"],
+                        type=str,
+                        help=("Estimator of the Astropy background statistics. 'subsample' and 'tiles' "
+                              "only use a fraction of the pixels and report their uncertainty.")
+                        )
+    parser.add_argument("--n_samples",
+                        dest="n_samples",
+                        action="store",
+                        default=100000,
+                        type=int,
+                        help="Number of pixels used by the 'subsample' and 'tiles' estimators."
+                        )
+    parser.add_argument("-t",
+                        "--targets",
+                        dest="targets",
+                        action="store",
+                        type=str,
+                        help=("CSV file with 'ra' and 'dec' (and optionally 'name') columns of several targets "
+                              "in the same image, measured in a single pass (replaces the ra and dec arguments).")
+                        )
+    parser.add_argument("--renderer",
+                        dest="renderer",
+                        action="store",
+                        choices=["aplpy", "fast"],
+                        type=str,
+                        help=("Plotting backend: 'aplpy' (full figure) or 'fast' (headless thumbnail "
+                              "without labels). By default, 'aplpy' for single runs and 'fast' in batch mode.")
+                        )
+    parser.add_argument("--name",
+                        dest="name",
+                        action="store",
+                        type=str,
+                        help="Name of the target."
+                        )
+    parser.add_argument("--store",
+                        dest="store",
+                        action="store",
+                        type=str,
+                        help=("SQLite database where the results are appended, indexed by file, "
+                              "target name and observation date.")
+                        )
+    parser.add_argument("--serve",
+                        dest="serve",
+                        action="store_true",
+                        help=("Runs as a server answering JSON-lines requests (file, ra, dec and options) "
+                              "from the standard input or a Unix socket. The given options are the defaults.")
+                        )
+    parser.add_argument("--socket",
+                        dest="socket",
+                        action="store",
+                        type=str,
+                        help="Path of the Unix socket used in server mode."
+                        )
+    parser.add_argument("-w",
+                        "--watch",
+                        dest="watch",
+                        action="store",
+                        type=str,
+                        help=("Directory to watch for new FITS files, which are checked as they arrive. "
+                              "The targets are taken from --targets (with 'name', 'ra' and 'dec' columns) "
+                              "or from the image header.")
+                        )
+    parser.add_argument("--poll_interval",
+                        dest="poll_interval",
+                        action="store",
+                        default=5.0,
+                        type=float,
+                        help="Time between polls of the watched directory, in seconds."
+                        )
+    parser.add_argument("--sweep_r_in",
+                        dest="sweep_r_in",
+                        nargs="+",
+                        type=float,
+                        help=("Grid of inner radii for an annulus sweep, e.g. '--sweep_r_in 2 3 4'. "
+                              "Requires --sweep_r_out.")
+                        )
+    parser.add_argument("--sweep_r_out",
+                        dest="sweep_r_out",
+                        nargs="+",
+                        type=float,
+                        help="Grid of outer radii for an annulus sweep, e.g. '--sweep_r_out 5 6 8'."
+                        )
+    
     args = parser.parse_args(args)
+    if args.serve:
+        defaults = {'r_in':args.r_in, 'r_out':args.r_out, 'method':args.method, 'percent':args.percent,
+                    'size':args.size, 'dest_dir':args.dest_dir, 'low_memory':bool(args.low_memory),
+                    'cache_dir':args.cache_dir, 'estimator':args.estimator, 'n_samples':args.n_samples,
+                    'renderer':args.renderer or 'fast', 'store':args.store}
+        serve(args.socket, defaults)
+        return
+    if args.watch is not None:
+        watch_directory(args.watch, args.targets, args.poll_interval, args.n_workers, 
+                        dest_dir=args.dest_dir, outfile=args.outfile, store=args.store,
+                        r_in=args.r_in, r_out=args.r_out, method=args.method, percent=args.percent,
+                        size=args.size, save_plot=bool(args.save_plot), low_memory=bool(args.low_memory),
+                        cache_dir=args.cache_dir, estimator=args.estimator, n_samples=args.n_samples,
+                        renderer=args.renderer or 'fast')
+        return
+    if args.manifest is not None:
+        check_background_batch(args.manifest, args.r_in, args.r_out, args.method, args.percent, args.size,
+                               args.dest_dir, args.outfile, args.n_workers, bool(args.save_plot),
+                               bool(args.low_memory), args.cache_dir, args.estimator, args.n_samples,
+                               args.renderer or 'fast', args.store)
+        return
+    if args.sweep_r_in is not None or args.sweep_r_out is not None:
+        if args.sweep_r_in is None or args.sweep_r_out is None or args.dec is None:
+            parser.error("an annulus sweep requires the file, ra and dec arguments, "
+                         "and both --sweep_r_in and --sweep_r_out")
+        check_background_sweep(args.file, args.ra, args.dec, args.sweep_r_in, args.sweep_r_out,
+                               args.method, args.percent, args.dest_dir, bool(args.low_memory), 
+                               args.cache_dir, args.estimator, args.n_samples)
+        return
+    if args.targets is not None and args.file is not None:
+        targets_df = pd.read_csv(args.targets)
+        args.ra, args.dec = targets_df.ra.values, targets_df.dec.values
+        if 'name' in targets_df.columns:
+            args.name = targets_df.name.values
+    if args.dec is None:
+        parser.error("the file, ra and dec arguments are required (unless --manifest is given)")
     check_background(args.file, args.ra, args.dec, args.r_in, args.r_out, 
-                     args.method, args.percent, args.size, args.show_plot, args.dest_dir)
+                     args.method, args.percent, args.size, args.show_plot, args.dest_dir,
+                     low_memory=bool(args.low_memory), cache_dir=args.cache_dir,
+                     estimator=args.estimator, n_samples=args.n_samples, 
+                     renderer=args.renderer or 'aplpy', name=args.name, store=args.store)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
\ No newline at end of file
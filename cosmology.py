@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import hashlib
+import argparse
+import threading
+import numpy as np
+from pathlib import Path
+
+from astropy.cosmology import FlatLambdaCDM, Planck15
+from local_cache import CACHE_DIR, atomic_write
+
+COSMOLOGIES = {'FlatLambdaCDM':FlatLambdaCDM(H0=70, Om0=0.3, Tcmb0=2.725),  # H0 between Planck and Riess et al. (2019)
+               'Planck15':Planck15,
+               }
+# redshift range and resolution of the tables
+Z_MIN, Z_MAX, N_GRID = 1e-5, 10.0, 10001
+
+_tables = {}
+_lock = threading.Lock()
+
+def build_table(cosmo, z_min=Z_MIN, z_max=Z_MAX, n_grid=N_GRID):
+    """Builds an interpolation table of the luminosity distance.
+
+    The table stores :math:`\\log_{10}(d_L/z)` on a grid uniform in :math:`\\log_{10}z`.
+    This function is smooth and tends to :math:`\\log_{10}(c/H_0)` at low redshift,
+    so linear interpolation is very accurate over the whole range.
+
+    Parameters
+    ----------
+    cosmo: astropy.cosmology.Cosmology
+        Cosmology.
+    z_min: float, default 'Z_MIN'
+        Minimum redshift of the table.
+    z_max: float, default 'Z_MAX'
+        Maximum redshift of the table.
+    n_grid: int, default 'N_GRID'
+        Number of grid points.
+
+    Returns
+    -------
+    log_z: ndarray
+        Grid of :math:`\\log_{10}z`.
+    log_dl_z: ndarray
+        :math:`\\log_{10}(d_L/z)`, with :math:`d_L` in Mpc.
+    """
+    log_z = np.linspace(np.log10(z_min), np.log10(z_max), n_grid)
+    z = 10 ** log_z
+    log_dl_z = np.log10(cosmo.luminosity_distance(z).value / z)
+
+    return log_z, log_dl_z
+
+def get_table(name='FlatLambdaCDM'):
+    """Obtains the interpolation table of a cosmology (see :func:`build_table()`).
+
+    The tables are built once and stored in the cache directory, keyed by the
+    parameters of the cosmology and of the grid.
+
+    Parameters
+    ----------
+    name: str, default 'FlatLambdaCDM'
+        Name of the cosmology (see ``COSMOLOGIES``).
+
+    Returns
+    -------
+    log_z: ndarray
+        Grid of :math:`\\log_{10}z`.
+    log_dl_z: ndarray
+        :math:`\\log_{10}(d_L/z)`, with :math:`d_L` in Mpc.
+    """
+    with _lock:
+        if name in _tables:
+            return _tables[name]
+
+        cosmo = COSMOLOGIES[name]
+        key = hashlib.blake2b(f'{cosmo!r}_{Z_MIN}_{Z_MAX}_{N_GRID}'.encode(), digest_size=8).hexdigest()
+        table_file = Path(CACHE_DIR, 'cosmology', f'{name}_{key}.npz')
+        try:
+            with np.load(table_file) as table:
+                log_z, log_dl_z = table['log_z'], table['log_dl_z']
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            log_z, log_dl_z = build_table(cosmo)
+            with atomic_write(table_file, 'wb') as file:
+                np.savez(file, log_z=log_z, log_dl_z=log_dl_z)
+        _tables[name] = log_z, log_dl_z
+
+    return _tables[name]
+
+def luminosity_distance(z, cosmo='FlatLambdaCDM'):
+    """Calculates the luminosity distance by interpolating a precomputed table.
+
+    Redshifts between ``Z_MIN`` and ``Z_MAX`` have relative errors below
+    :math:`10^{-8}` (see :func:`check_table()`). Redshifts outside this range
+    are calculated exactly with astropy.
+
+    Parameters
+    ----------
+    z: float or array
+        Redshift(s).
+    cosmo: str, default 'FlatLambdaCDM'
+        Name of the cosmology (see ``COSMOLOGIES``).
+
+    Returns
+    -------
+    dl: float or ndarray
+        Luminosity distance, in Mpc.
+    """
+    log_z, log_dl_z = get_table(cosmo)
+    z_array = np.asarray(z, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.log10(z_array)
+        dl = z_array * 10 ** np.interp(x, log_z, log_dl_z)
+
+    outside = ~((x >= log_z[0]) & (x <= log_z[-1]))
+    if np.any(outside):
+        dl = np.array(dl)
+        dl[outside] = COSMOLOGIES[cosmo].luminosity_distance(z_array[outside]).value
+    if np.ndim(z) == 0:
+        return float(dl)
+
+    return dl
+
+def distmod(z, cosmo='FlatLambdaCDM'):
+    """Calculates the distance modulus by interpolating a precomputed table
+    (see :func:`luminosity_distance()`).
+
+    Redshifts between ``Z_MIN`` and ``Z_MAX`` have absolute errors below
+    :math:`10^{-7}` mag (see :func:`check_table()`).
+
+    Parameters
+    ----------
+    z: float or array
+        Redshift(s).
+    cosmo: str, default 'FlatLambdaCDM'
+        Name of the cosmology (see ``COSMOLOGIES``).
+
+    Returns
+    -------
+    mu: float or ndarray
+        Distance modulus, in magnitudes.
+    """
+    dl = luminosity_distance(z, cosmo)
+    with np.errstate(divide='ignore'):
+        mu = 5 * np.log10(dl) + 25  # dl in Mpc
+
+    return mu
+
+def check_table(cosmo='FlatLambdaCDM', n_test=100000, seed=0):
+    """Compares the interpolated distance modulus against astropy.
+
+    Parameters
+    ----------
+    cosmo: str, default 'FlatLambdaCDM'
+        Name of the cosmology (see ``COSMOLOGIES``).
+    n_test: int, default '100000'
+        Number of random redshifts (log-uniform between ``Z_MIN`` and ``Z_MAX``).
+    seed: int, default '0'
+        Seed of the random number generator.
+
+    Returns
+    -------
+    max_error: float
+        Maximum absolute error of the distance modulus, in magnitudes.
+    speedup: float
+        Speedup with respect to astropy.
+    """
+    rng = np.random.default_rng(seed)
+    z = 10 ** rng.uniform(np.log10(Z_MIN), np.log10(Z_MAX), n_test)
+    get_table(cosmo)
+
+    start = time.perf_counter()
+    mu = distmod(z, cosmo)
+    table_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mu_exact = COSMOLOGIES[cosmo].distmod(z).value
+    exact_time = time.perf_counter() - start
+
+    max_error = np.max(np.abs(mu - mu_exact))
+    speedup = exact_time / table_time
+
+    return max_error, speedup
+
+def main(args=None):
+    description = f"Distance moduli from precomputed cosmology tables"
+    usage = "cosmology [z ...] [options]"
+
+    parser = argparse.ArgumentParser(prog='cosmology',
+                                     usage=usage,
+                                     description=description,
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+    parser.add_argument("z",
+                        nargs="*",
+                        type=float,
+                        help="Redshift(s)."
+                        )
+    parser.add_argument("-c",
+                        "--cosmo",
+                        dest="cosmo",
+                        action="store",
+                        default="FlatLambdaCDM",
+                        choices=list(COSMOLOGIES.keys()),
+                        type=str,
+                        help="Cosmology."
+                        )
+    parser.add_argument("--check",
+                        dest="check",
+                        action="store_true",
+                        help="Compares the tables of all the cosmologies against astropy."
+                        )
+
+    args = parser.parse_args(args)
+    for z in args.z:
+        mu = distmod(z, args.cosmo)
+        print(f'z = {z}: distance modulus = {mu:.4f} [mag] | '
+              f'luminosity distance = {luminosity_distance(z, args.cosmo):.4e} [Mpc]')
+    if args.check:
+        for name in COSMOLOGIES.keys():
+            max_error, speedup = check_table(name)
+            print(f'{name}: maximum error = {max_error:.2e} [mag] | speedup = {speedup:.0f}x')
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
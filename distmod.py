@@ -23,17 +23,13 @@ def main():
 main()
 '''
 
-import sys
-from astropy.cosmology import FlatLambdaCDM
-import astropy.units as u
-
-#H0 between Planck and Riess et al. (2019)
-cosmo = FlatLambdaCDM(H0=70 * u.km / u.s / u.Mpc, Tcmb0=2.725 * u.K, Om0=0.3)
+from cosmology import distmod
 
 def main():
     x1 = input('redshift:')
     z = float(x1)
-    mu = cosmo.distmod(z).value
+    #FlatLambdaCDM with H0 between Planck and Riess et al. (2019)
+    mu = distmod(z, 'FlatLambdaCDM')
     d = 10**(mu/5 + 1)
     
     x2 = input('apparent magnitude: ')
@@ -46,4 +42,5 @@ def main():
         M = m - mu
         print('absolute magnitude: %.3f [mag]' % M)
 
-main()
+if __name__ == "__main__":
+    main()
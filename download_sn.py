@@ -3,25 +3,28 @@
 import json
 import pickle
 import os.path
-import subprocess
+import http_client
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from lightcurve_store import STORE_FILE, save_lightcurve
+
 def main():
     print('Download from the Open Supernova Catalog')
     print('------------------------------------------')
     sn = input('Enter SN name (e.g., SN2011fe):')
     
-    url = f'https://sne.space/astrocats/astrocats/supernovae/output/json/{sn}.json'
+    url = f"{http_client.get_base_url('osc')}/{sn}.json"
     
     if os.path.isfile(f'{sn}.json'):
         download = input(f'The file {sn}.json already exists, download anyway? ([no]|yes):')
         if download=='yes' or download=='y':
-            print('Warning: the file will be saved with a different name given that it is a copy.')
-            subprocess.call(['wget', url])
+            print('Warning: the existing file will be overwritten.')
+            # the catalog is not updated anymore, so cached copies are kept for a month
+            http_client.download(url, f'{sn}.json', cache_ttl=0)
     else:
-        subprocess.call(['wget', url])
+        http_client.download(url, f'{sn}.json', cache_ttl=24 * 30)
 
     ######## photometry ########
     with open(f'{sn}.json') as f:
@@ -49,6 +52,8 @@ def main():
     sn_df = pd.DataFrame.from_dict(sn_dict)
     sn_df = sn_df.sort_values(['band', 'mjd'])
     sn_df.to_csv(f'{sn}.phot', index=False)  
+    n_rows = save_lightcurve(sn_df, sn, 'osc')
+    print(f'{n_rows} epochs saved in the light-curve store ({STORE_FILE})')
 
     ######## spectroscopy ########
     with open(f'{sn}.json') as input_file:
@@ -117,4 +122,5 @@ def main():
 
         plt.show()  
 
-main()
+if __name__ == "__main__":
+    main()
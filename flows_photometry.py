@@ -1,11 +1,86 @@
 #!/usr/bin/env python
 
 import os
+import csv
 import sys
-import glob
+import json
+import hashlib
 import argparse
 import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from local_cache import atomic_write
+from lightcurve_store import STORE_FILE, save_lightcurve
+
+# format of the manifest of processed files (older manifests are rebuilt)
+MANIFEST_VERSION = 2
+
+def read_photometry(file):
+    """Extracts the metadata and the SN photometry from an image reduced 
+    with the FLOWS pipeline, reading the file only once.
+
+    The header is parsed for the metadata and the table is streamed until
+    the target rows are found, without parsing the reference-star catalogue.
+    The target rows ('starid' -1 and 0) come first in FLOWS files, so the 
+    reading stops at the template-subtracted row (-1) or at the first 
+    reference star after the unsubtracted row (0).
+    
+    Parameters
+    ----------
+    file: str
+        'photometry.ecsv' file in an image directory.
+        
+    Returns
+    -------
+    filt: str
+        Filter used.
+    mjd: str
+        Time of observation.
+    mag: float
+        SN magnitude.
+    mag_err: float
+        SN magnitude error.
+    sub: int
+        Whether the image was template subtracted:
+        '-1' is template subtracted and '0' is no subtraction.
+    """
+    filt = mjd = None
+    target_rows = {}
+    
+    with open(file, 'r') as phot_file:
+        # header: metadata and column names
+        columns = None
+        for line in phot_file:
+            if line.startswith('#'):
+                if 'photfilter' in line:
+                    filt = line.split()[-1].split('}')[0]
+                if 'obstime-bmjd' in line:
+                    mjd = line.split()[-1].split('}')[0]
+            elif line.strip():
+                columns = next(csv.reader([line]))
+                break
+        if columns is None:
+            raise ValueError(f'No photometry table in {file}')
+        i_starid, i_mag, i_err = (columns.index(column) for column in ['starid', 'mag', 'mag_error'])
+
+        # table: only until the target rows are found
+        for row in csv.reader(phot_file):
+            if not row or row[0].startswith('#'):
+                continue
+            starid = int(float(row[i_starid]))
+            if starid in [-1, 0]:
+                target_rows[starid] = row
+            if starid == -1 or (starid > 0 and 0 in target_rows):
+                break
+
+    sub = -1 if -1 in target_rows else 0
+    if sub not in target_rows:
+        raise ValueError(f'No SN photometry in {file}')
+    row = target_rows[sub]
+    mag, mag_err = (float(row[i]) if row[i] else np.nan for i in [i_mag, i_err])
+
+    return filt, mjd, mag, mag_err, sub
 
 def get_metadata(file):
     """Obtains info from an image reduced with the FLOWS pipeline.
@@ -22,14 +97,7 @@ def get_metadata(file):
     mjd: float
         Time of observation.
     """
-    filt = mjd = None
-    
-    with open(file, 'r') as info_file:
-        for line in info_file.readlines():
-            if 'photfilter' in line:
-                filt = line.split()[-1].split('}')[0]
-            if 'obstime-bmjd' in line:
-                mjd = line.split()[-1].split('}')[0]
+    filt, mjd = read_photometry(file)[:2]
 
     return filt, mjd
 
@@ -51,18 +119,141 @@ def get_magnitude(file):
         Whether the image was template subtracted:
         '-1' is template subtracted and '0' is no subtraction.
     """
-    init_df = pd.read_csv(file, comment='#')
-    df = init_df[init_df.starid==-1]
-    sub = -1
-    if len(df)==0:
-        df = init_df[init_df.starid==0]
-        sub = 0
-    mag, mag_err = df.mag.values[0], df.mag_error.values[0]
+    mag, mag_err, sub = read_photometry(file)[2:]
     
     return mag, mag_err, sub
 
-def flows_photometry(target, subtraction=1):
+def list_image_directories(target):
+    """Lists the image directories of a target, sorted by name.
+    
+    Parameters
+    ----------
+    target: str
+        Target directory.
+        
+    Returns
+    -------
+    img_directories: list
+        Image directories.
+    """
+    with os.scandir(target) as entries:
+        # the directory type usually comes with the listing (no extra stat calls)
+        img_directories = sorted(entry.path for entry in entries if entry.is_dir())
+
+    return img_directories
+
+def find_photometry_file(directory):
+    """Finds the photometry file of an image directory.
+
+    The usual 'photometry.ecsv' file is probed directly. Only if missing,
+    the directory is listed for other '*photometry.ecsv' files.
+    
+    Parameters
+    ----------
+    directory: str
+        Image directory.
+        
+    Returns
+    -------
+    phot_file: str or None
+        Photometry file. ``None`` if not found.
+    """
+    phot_file = os.path.join(directory, 'photometry.ecsv')
+    if os.path.isfile(phot_file):
+        return phot_file
+
+    with os.scandir(directory) as entries:
+        phot_files = sorted(entry.path for entry in entries if entry.name.endswith('photometry.ecsv'))
+
+    return phot_files[0] if phot_files else None
+
+def get_file_hash(file, chunk_size=2**20):
+    """Obtains the BLAKE2 hash of a file's content.
+    """
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(file, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(chunk_size), b''):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+def extract_photometry(phot_file):
+    """Extracts the SN photometry from a photometry file.
+    
+    Parameters
+    ----------
+    phot_file: str
+        'photometry.ecsv' file in an image directory.
+        
+    Returns
+    -------
+    phot_row: dict
+        Photometry (MJD, magnitude, error, filter and subtraction). 
+        The MJD keeps its full precision.
+    """
+    filt, mjd, mag, mag_err, sub = read_photometry(phot_file)
+    phot_row = {'mjd':float(mjd), 
+                'mag':np.round(mag, 2), 
+                'mag_err':np.round(mag_err, 2),
+                'filt':filt,
+                'subtraction':sub}
+
+    return phot_row
+
+def update_photometry(directory, entry=None):
+    """Extracts the SN photometry of an image directory, unless it is
+    already in the manifest entry.
+
+    Files with the same modification time and size as in the entry are not
+    read at all. Files with a different modification time are hashed and 
+    only parsed if the content changed.
+    
+    Parameters
+    ----------
+    directory: str
+        Image directory.
+    entry: dict, default 'None'
+        Manifest entry of the directory (see :func:`flows_photometry()`).
+        
+    Returns
+    -------
+    entry: dict or None
+        Updated manifest entry, with the photometry file, its modification
+        time, size and hash, and the photometry. ``None`` if the directory 
+        has no photometry file.
+    parsed: bool
+        Whether the photometry file was parsed.
+    """
+    phot_file = find_photometry_file(directory)
+    if phot_file is None:
+        return None, False
+
+    stat = os.stat(phot_file)
+    if entry is not None and entry['file'] == phot_file:
+        if entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return entry, False
+        file_hash = get_file_hash(phot_file)
+        if entry['hash'] == file_hash:
+            return dict(entry, mtime_ns=stat.st_mtime_ns), False
+    else:
+        file_hash = get_file_hash(phot_file)
+
+    entry = {'file':phot_file, 'mtime_ns':stat.st_mtime_ns, 'size':stat.st_size,
+             'hash':file_hash, 'phot':extract_photometry(phot_file)}
+
+    return entry, True
+
+def flows_photometry(target, subtraction=1, n_workers=16, incremental=True):
     """Extracts FLOWS photometry.
+
+    The image directories are parsed in a thread pool, as the time is
+    mostly spent waiting for the file system (e.g. on network drives).
+    The output does not depend on the number of workers.
+
+    A manifest of the processed photometry files (``<target>_phot_manifest.json``) 
+    is kept with their modification times, hashes and photometry, so only new 
+    or changed files are parsed in the following runs. The photometry of removed 
+    directories is dropped.
     
     Parameters
     ----------
@@ -71,49 +262,67 @@ def flows_photometry(target, subtraction=1):
     subtraction: int, default '1'
         Whether to extract the photometry from template-subtracted
         images (-1), unsubtracted images (0) or both (1).
+    n_workers: int, default '16'
+        Number of threads.
+    incremental: bool, default 'True'
+        Whether to reuse the manifest of previous runs. If ``False``, 
+        all the files are parsed (and the manifest is rebuilt).
+
+    Returns
+    -------
+    phot_df: DataFrame
+        FLOWS photometry, with full-precision MJDs (rounded to 0.01 days
+        in the output file).
     """
-    img_directories = glob.glob(f'{target}/*')
-
-    phot_dir = {'mjd':[], 'mag':[], 'mag_err':[], 'filt':[], 'subtraction':[]}
-    for directory in img_directories:
-        if os.path.isdir(directory) is False:
-            continue  # not a directory, so skip
-
-        # get all the files in an image directory and get the photometry file
-        dir_files = glob.glob(f'{directory}/*')
-        try:
-            phot_file = [file for file in dir_files if file.endswith('photometry.ecsv')][0]
-        except:
-            print(f'Skipping {directory} - no "photometry.ecsv" file')
-            continue  # skip this image 
-
-        filt, mjd = get_metadata(phot_file)
-        mag, mag_err, sub = get_magnitude(phot_file)
-        mag = np.round(mag, 2)
-        mag_err = np.round(mag_err, 2)
-        mjd = np.round(float(mjd), 2)
-
-        phot_dir['mjd'].append(mjd)
-        phot_dir['mag'].append(mag)
-        phot_dir['mag_err'].append(mag_err)
-        phot_dir['filt'].append(filt)
-        phot_dir['subtraction'].append(sub)
-        
+    manifest_file = f'{target}_phot_manifest.json'
+    manifest = {}
+    if incremental is True and os.path.isfile(manifest_file):
+        with open(manifest_file, 'r') as file:
+            manifest_dict = json.load(file)
+        if manifest_dict.get('version') == MANIFEST_VERSION:
+            manifest = manifest_dict['entries']
+
+    img_directories = list_image_directories(target)
+    # relative paths, so the manifest does not depend on the working directory
+    dir_keys = [os.path.relpath(directory, target) for directory in img_directories]
+    entries = [manifest.get(dir_key) for dir_key in dir_keys]
+    for entry, directory in zip(entries, img_directories):
+        if entry is not None:
+            entry['file'] = os.path.join(directory, entry['file'])
+
+    phot_rows, new_manifest, n_parsed = [], {}, 0
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        # results come in the same order as the directories
+        results = executor.map(update_photometry, img_directories, entries)
+        for directory, dir_key, (entry, parsed) in zip(img_directories, dir_keys, results):
+            if entry is None:
+                print(f'Skipping {directory} - no "photometry.ecsv" file')
+                continue  # skip this image 
+            phot_rows.append(entry['phot'])
+            new_manifest[dir_key] = dict(entry, file=os.path.relpath(entry['file'], directory))
+            n_parsed += parsed
+    n_removed = len(set(manifest.keys()) - set(new_manifest.keys()))
+    print(f'{n_parsed} new or changed, {len(phot_rows) - n_parsed} unchanged '
+          f'and {n_removed} removed photometry files')
     
-    phot_df = pd.DataFrame(phot_dir)
+    phot_df = pd.DataFrame(phot_rows, columns=['mjd', 'mag', 'mag_err', 'filt', 'subtraction'])
     
     # sort by filter, then by mjd
     sorter_dict = {'B':0, 'V':1, 'R':2, 'I':3, 
                    'gp':4, 'rp':5, 'ip':6, 
                    'Y':7, 'J':8, 'H':9, 'K':10}
     phot_df['filt_num'] = [sorter_dict[filt] for filt in phot_df.filt.values]
-    phot_df.sort_values(['filt_num', 'mjd'], inplace=True, ignore_index=True)
+    phot_df.sort_values(['filt_num', 'mjd'], inplace=True, ignore_index=True, kind='stable')
     
     # mask by subtraction
     if subtraction in [-1, 0]:
         phot_df = phot_df[phot_df.subtraction==subtraction]
     
-    phot_df.to_csv(f'{target}_phot.csv', index=False)
+    phot_df.round({'mjd':2}).to_csv(f'{target}_phot.csv', index=False)
+    with atomic_write(manifest_file) as file:
+        json.dump({'version':MANIFEST_VERSION, 'entries':new_manifest}, file)
+
+    return phot_df
 
 
 def create_snoopy_file(target, z, ra, dec):
@@ -180,8 +389,32 @@ def main(args=None):
                               "must be given (in that order), e.g. '--snpy 0.0532 12.340 0.344'.")
                         )
     
+    parser.add_argument("-j",
+                        "--n_workers",
+                        dest="n_workers",
+                        action="store",
+                        default=16,
+                        type=int,
+                        help=("Number of threads used to parse the image directories (default: 16).")
+                        )
+    parser.add_argument("--full",
+                        dest="incremental",
+                        action="store_false",
+                        help=("Parses all the photometry files, ignoring the manifest of previous runs.")
+                        )
+    parser.add_argument("--store",
+                        dest="store",
+                        nargs="?",
+                        const=str(STORE_FILE),
+                        type=str,
+                        help=(f"Saves the photometry into the light-curve store (default: {STORE_FILE}).")
+                        )
+    
     args = parser.parse_args(args)
-    flows_photometry(args.directory, args.subtraction)
+    phot_df = flows_photometry(args.directory, args.subtraction, args.n_workers, args.incremental)
+    if args.store is not None:
+        target = os.path.basename(os.path.normpath(args.directory))
+        save_lightcurve(phot_df, target, 'flows', args.store)
 
     if args.snpy is not None:
         z, ra, dec = args.snpy
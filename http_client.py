@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from local_cache import CACHE_DIR, atomic_write
+
+HTTP_CACHE_DIR = Path(CACHE_DIR, 'http')
+
+# host: (requests per second, burst size)
+RATE_LIMITS = {'www.wis-tns.org': (0.5, 5),
+               'api.alerce.online': (5, 10),
+               'fallingstar-data.com': (5, 10),
+               'sne.space': (2, 5),
+               }
+DEFAULT_RATE_LIMIT = (5, 10)
+# base URL of each service
+BASE_URLS = {'tns': 'https://www.wis-tns.org',
+             'alerce': 'https://api.alerce.online',
+             'atlas': 'https://fallingstar-data.com/forcedphot',
+             'osc': 'https://sne.space/astrocats/astrocats/supernovae/output/json',
+             }
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_session = None
+_buckets = {}  # host: token-bucket state
+_lock = threading.Lock()
+
+def get_session():
+    """Obtains the session shared by all the requests, which keeps the
+    connections to each host alive (pooled).
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+
+    return _session
+
+def get_base_url(service):
+    """Obtains the base URL of a service (see ``BASE_URLS``).
+
+    The URL can be replaced with the ``<SERVICE>_BASE_URL`` environment variable
+    (e.g. ``ALERCE_BASE_URL``), or all the services can be pointed to a single
+    server (e.g. ``mock_services``), under ``/<service>``, with ``EXECUTABLES_BASE_URL``.
+
+    Parameters
+    ----------
+    service: str
+        Name of the service: 'tns', 'alerce', 'atlas' or 'osc'.
+
+    Returns
+    -------
+    base_url: str
+        Base URL, without trailing slash.
+    """
+    base_url = os.environ.get(f'{service.upper()}_BASE_URL')
+    if base_url is None and os.environ.get('EXECUTABLES_BASE_URL'):
+        base_url = f"{os.environ['EXECUTABLES_BASE_URL'].rstrip('/')}/{service}"
+    if base_url is None:
+        base_url = BASE_URLS[service]
+
+    return base_url.rstrip('/')
+
+def get_bucket(host):
+    """Obtains the token bucket of a host (see ``RATE_LIMITS``).
+    """
+    with _lock:
+        if host not in _buckets:
+            rate, capacity = RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT)
+            _buckets[host] = {'rate':rate, 'capacity':capacity, 'tokens':capacity,
+                              'updated':time.monotonic(), 'lock':threading.Lock()}
+
+    return _buckets[host]
+
+def acquire_token(host):
+    """Waits until a request to the given host is allowed by its rate limit.
+
+    Each request takes a token from the bucket of the host, which is refilled at
+    a constant rate up to the burst size. Tokens can be reserved in advance
+    (negative balance), so concurrent callers are served in order.
+    """
+    bucket = get_bucket(host)
+    with bucket['lock']:
+        now = time.monotonic()
+        elapsed = now - bucket['updated']
+        bucket['tokens'] = min(bucket['capacity'], bucket['tokens'] + elapsed * bucket['rate'])
+        bucket['updated'] = now
+        bucket['tokens'] -= 1
+        waittime = -bucket['tokens'] / bucket['rate'] if bucket['tokens'] < 0 else 0.0
+    if waittime > 0:
+        time.sleep(waittime)
+
+def pause_host(host, seconds):
+    """Delays all the upcoming requests to a host by (at least) the given time.
+    """
+    bucket = get_bucket(host)
+    with bucket['lock']:
+        bucket['tokens'] = min(bucket['tokens'], 0.0) - seconds * bucket['rate']
+
+def get_retry_wait(resp, attempt, backoff=1, max_backoff=60):
+    """Obtains the waiting time before retrying a request.
+
+    The ``x-rate-limit-reset`` (TNS) and ``Retry-After`` headers are honoured.
+    Otherwise, the waiting time grows exponentially with the number of attempts.
+
+    Parameters
+    ----------
+    resp: Response or None
+        Failed response. ``None`` for connection errors.
+    attempt: int
+        Number of the failed attempt (starting from 0).
+    backoff: float, default '1'
+        Waiting time after the first attempt, in seconds.
+    max_backoff: float, default '60'
+        Maximum waiting time of the exponential backoff, in seconds.
+
+    Returns
+    -------
+    waittime: float
+        Waiting time, in seconds.
+    """
+    if resp is not None:
+        for header in ['x-rate-limit-reset', 'Retry-After']:
+            try:
+                return float(resp.headers[header])
+            except (KeyError, ValueError):
+                pass
+
+    return min(backoff * 2 ** attempt, max_backoff)
+
+def get_cache_files(method, url, kwargs):
+    """Obtains the files of a cached response (metadata and content).
+    """
+    key = json.dumps([method, url, kwargs.get('params'), kwargs.get('data')],
+                     sort_keys=True, default=str)
+    key_hash = hashlib.sha256(key.encode()).hexdigest()
+    meta_file = Path(HTTP_CACHE_DIR, f'{key_hash}.json')
+    content_file = Path(HTTP_CACHE_DIR, f'{key_hash}.body')
+
+    return meta_file, content_file
+
+def load_cached_response(meta_file, content_file, cache_ttl):
+    """Loads a cached response if younger than ``cache_ttl`` hours.
+    """
+    try:
+        with open(meta_file, 'r') as file:
+            meta = json.load(file)
+        if (time.time() - meta['fetched']) / 3600 >= cache_ttl:
+            return None
+        with open(content_file, 'rb') as file:
+            content = file.read()
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+
+    resp = requests.Response()
+    resp.status_code = meta['status_code']
+    resp.url = meta['url']
+    resp.headers = CaseInsensitiveDict(meta['headers'])
+    resp.encoding = meta['encoding']
+    resp._content = content
+
+    return resp
+
+def save_cached_response(meta_file, content_file, resp):
+    """Saves a response into the cache (atomically).
+    """
+    meta = {'fetched':time.time(), 'status_code':resp.status_code, 'url':resp.url,
+            'headers':dict(resp.headers), 'encoding':resp.encoding}
+    for outfile, content in [(content_file, resp.content), (meta_file, json.dumps(meta).encode())]:
+        with atomic_write(outfile, 'wb') as file:
+            file.write(content)
+
+def request(method, url, retries=3, backoff=1, max_backoff=60, cache_ttl=None,
+            timeout=60, **kwargs):
+    """Sends a request through the shared session, with per-host rate limiting
+    and retries.
+
+    Throttled (429), server-error (5xx) and failed (connection error or timeout)
+    requests are retried after the time given by :func:`get_retry_wait()`.
+    While waiting for a throttled request, the other requests to the same host
+    are also delayed.
+
+    Parameters
+    ----------
+    method: str
+        HTTP method (e.g. 'GET').
+    url: str
+        URL of the request.
+    retries: int, default '3'
+        Maximum number of retries. With ``0``, throttled and failed
+        responses are returned as they are, so the caller handles them.
+    backoff: float, default '1'
+        Waiting time after the first failed attempt, in seconds.
+    max_backoff: float, default '60'
+        Maximum waiting time of the exponential backoff, in seconds.
+    cache_ttl: float, default 'None'
+        If given, successful GET responses are cached on disk and reused
+        while younger than this many hours. ``0`` updates the cache.
+    timeout: float, default '60'
+        Timeout of each attempt, in seconds.
+    kwargs: dict
+        Other arguments of ``requests.Session.request`` (e.g. ``headers``).
+
+    Returns
+    -------
+    resp: Response
+        Response of the last attempt.
+    """
+    method = method.upper()
+    use_cache = cache_ttl is not None and method == 'GET'
+    if use_cache:
+        meta_file, content_file = get_cache_files(method, url, kwargs)
+        resp = load_cached_response(meta_file, content_file, cache_ttl)
+        if resp is not None:
+            return resp
+
+    host = urlparse(url).netloc
+    session = get_session()
+    for attempt in range(retries + 1):
+        acquire_token(host)
+        try:
+            resp = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == retries:
+                raise
+            time.sleep(get_retry_wait(None, attempt, backoff, max_backoff))
+            continue
+
+        if resp.status_code not in RETRY_STATUS or attempt == retries:
+            break
+        waittime = get_retry_wait(resp, attempt, backoff, max_backoff)
+        print(f'{resp.status_code} from {host}: retrying in {waittime:.1f} seconds', file=sys.stderr)
+        if resp.status_code == 429:
+            pause_host(host, waittime)
+        else:
+            time.sleep(waittime)
+
+    if use_cache and resp.status_code == 200:
+        save_cached_response(meta_file, content_file, resp)
+
+    return resp
+
+def get(url, **kwargs):
+    """Sends a GET request (see :func:`request()`).
+    """
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    """Sends a POST request (see :func:`request()`).
+    """
+    return request('POST', url, **kwargs)
+
+def delete(url, **kwargs):
+    """Sends a DELETE request (see :func:`request()`).
+    """
+    return request('DELETE', url, **kwargs)
+
+def download(url, outfile, **kwargs):
+    """Downloads a file (see :func:`request()`). The file is only
+    written if the download succeeds.
+
+    Parameters
+    ----------
+    url: str
+        URL of the file.
+    outfile: str or Path
+        Output file.
+    kwargs: dict
+        Other arguments of :func:`request()`.
+
+    Returns
+    -------
+    outfile: Path
+        Output file.
+    """
+    resp = request('GET', url, **kwargs)
+    resp.raise_for_status()
+    outfile = Path(outfile)
+    with atomic_write(outfile, 'wb') as file:
+        file.write(resp.content)
+
+    return outfile
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+import sys
+import time
+import sqlite3
+import argparse
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from tns_cache import normalize_name
+from local_cache import CACHE_DIR
+STORE_FILE = Path(CACHE_DIR, 'lightcurves.sqlite')
+
+# common schema of all the surveys (fluxes in microjanskys, only for AB magnitudes)
+LC_COLUMNS = {'object':'TEXT NOT NULL', 'survey':'TEXT NOT NULL', 'filter':'TEXT NOT NULL',
+              'mjd':'REAL NOT NULL', 'mag':'REAL', 'mag_err':'REAL', 'flux':'REAL',
+              'flux_err':'REAL', 'subtraction':'INTEGER NOT NULL DEFAULT 1', 'updated':'REAL'}
+# unique key of the epochs. FLOWS measures the same epoch with (-1) and without (0)
+# template subtraction, while the other surveys have a single measurement (1)
+KEY_COLUMNS = ['object', 'survey', 'filter', 'mjd', 'subtraction']
+# column names used by each source: ZTF/ATLAS (plot_lightcurves),
+# FLOWS (flows_photometry) and OSC (download_sn)
+RENAME_COLUMNS = {'time':'mjd', 'filt':'filter', 'band':'filter', 'err':'mag_err',
+                  'uJy':'flux', 'duJy':'flux_err'}
+# filters with AB magnitudes in each survey (None for all of them). The other
+# magnitudes (e.g. Vega for FLOWS BVRI and JHK, or OSC) are not converted into fluxes
+AB_FILTERS = {'ztf':None, 'atlas':None, 'flows':['gp', 'rp', 'ip']}
+
+def connect_lightcurve_store(store=STORE_FILE):
+    """Connects to the light-curve store (an SQLite database), creating it if needed.
+
+    Each row is one epoch of an object in a survey and filter. The table is
+    clustered by its unique key (see ``KEY_COLUMNS``), so the epochs of an object
+    are stored together and sorted by time. Tables created with an older key
+    are migrated.
+
+    Parameters
+    ----------
+    store: str or Path, default 'STORE_FILE'
+        Database file name.
+
+    Returns
+    -------
+    conn: ~sqlite3.Connection
+        Database connection.
+    """
+    Path(store).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(store, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    columns = ', '.join(f'{column} {sql_type}' for column, sql_type in LC_COLUMNS.items())
+    create_table = (f'CREATE TABLE IF NOT EXISTS photometry ({columns}, '
+                    f'PRIMARY KEY ({", ".join(KEY_COLUMNS)})) WITHOUT ROWID')
+    with conn:
+        key = [row[1] for row in sorted(conn.execute('PRAGMA table_info(photometry)'),
+                                        key=lambda row: row[5]) if row[5] > 0]
+        if key and key != KEY_COLUMNS:
+            # older key: the table is rebuilt with the new one
+            conn.execute('ALTER TABLE photometry RENAME TO photometry_old')
+            conn.execute('DROP INDEX IF EXISTS idx_object_mjd')
+            conn.execute(create_table)
+            names = ', '.join(LC_COLUMNS.keys())
+            values = ', '.join('COALESCE(subtraction, 1)' if column == 'subtraction' else column
+                               for column in LC_COLUMNS.keys())
+            conn.execute(f'INSERT OR REPLACE INTO photometry ({names}) '
+                         f'SELECT {values} FROM photometry_old')
+            conn.execute('DROP TABLE photometry_old')
+        conn.execute(create_table)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_object_mjd ON photometry (object, mjd)')
+
+    return conn
+
+def standardize_lightcurve(lc_df, survey):
+    """Converts a light curve into the common schema of the store.
+
+    The filter names lose the survey prefix (e.g. 'ztf_g' -> 'g'), the MJDs keep
+    their full precision, missing subtraction flags are set to 1 (see ``KEY_COLUMNS``)
+    and missing fluxes are calculated from the magnitudes, only if these are AB magnitudes (see ``AB_FILTERS``). Otherwise,
+    the fluxes are left empty.
+
+    Parameters
+    ----------
+    lc_df: DataFrame
+        Light curve from any of the sources (see ``RENAME_COLUMNS``).
+    survey: str
+        Survey name (e.g. 'ztf', 'atlas', 'flows' or 'osc').
+
+    Returns
+    -------
+    std_df: DataFrame
+        Light curve with the columns of ``LC_COLUMNS`` (except for ``object`` and ``updated``).
+    """
+    std_df = lc_df.rename(columns=RENAME_COLUMNS)
+    std_df = std_df.loc[:, ~std_df.columns.duplicated()]
+    columns = [column for column in LC_COLUMNS if column not in ['object', 'updated']]
+    std_df = std_df.reindex(columns=columns)
+
+    std_df['survey'] = survey
+    std_df['filter'] = std_df['filter'].astype(str).str.replace(f'^{survey}_', '', regex=True)
+    std_df['mjd'] = std_df['mjd'].astype(float)
+    std_df['subtraction'] = pd.to_numeric(std_df['subtraction'], errors='coerce').fillna(1).astype(int)
+    for column in ['mag', 'mag_err', 'flux', 'flux_err']:
+        std_df[column] = pd.to_numeric(std_df[column], errors='coerce')
+    # AB magnitudes into microjanskys
+    if survey not in AB_FILTERS:
+        is_ab = False
+    elif AB_FILTERS[survey] is None:
+        is_ab = True
+    else:
+        is_ab = std_df['filter'].isin(AB_FILTERS[survey])
+    no_flux = std_df.flux.isna() & std_df.mag.notna() & is_ab
+    std_df.loc[no_flux, 'flux'] = 10 ** (-0.4 * (std_df.loc[no_flux, 'mag'] - 23.9))
+    no_flux_err = std_df.flux_err.isna() & std_df.flux.notna() & std_df.mag_err.notna()
+    std_df.loc[no_flux_err, 'flux_err'] = (np.log(10) / 2.5 * std_df.loc[no_flux_err, 'flux']
+                                           * std_df.loc[no_flux_err, 'mag_err'])
+
+    return std_df[np.isfinite(std_df.mjd.values)]
+
+def save_lightcurve(lc_df, object_name, survey, store=STORE_FILE):
+    """Adds the light curve of an object to the store.
+
+    Epochs already in the store (same survey, filter, MJD and subtraction) are
+    replaced, so the same light curve can be saved many times without duplicates.
+
+    Parameters
+    ----------
+    lc_df: DataFrame
+        Light curve (see :func:`standardize_lightcurve()`).
+    object_name: str
+        Name of the object (e.g. 2011fe).
+    survey: str
+        Survey name (e.g. 'ztf', 'atlas', 'flows' or 'osc').
+    store: str or Path, default 'STORE_FILE'
+        Database file name.
+
+    Returns
+    -------
+    n_rows: int
+        Number of epochs saved.
+    """
+    if lc_df is None or len(lc_df) == 0:
+        return 0
+    std_df = standardize_lightcurve(lc_df, survey)
+    std_df.insert(0, 'object', normalize_name(object_name))
+    std_df['updated'] = time.time()
+    # duplicated epochs within the same light curve: the last one is kept
+    std_df = std_df.drop_duplicates(KEY_COLUMNS, keep='last')
+
+    columns = list(LC_COLUMNS.keys())
+    rows = std_df[columns].astype(object).where(std_df[columns].notna(), None).values.tolist()
+    placeholders = ', '.join('?' * len(columns))
+    conn = connect_lightcurve_store(store)
+    try:
+        with conn:  # single transaction
+            conn.executemany(f'INSERT OR REPLACE INTO photometry ({", ".join(columns)}) '
+                             f'VALUES ({placeholders})', rows)
+    finally:
+        conn.close()
+
+    return len(rows)
+
+def query_lightcurves(objects=None, surveys=None, filters=None, mjd_min=None, mjd_max=None,
+                      columns=None, store=STORE_FILE):
+    """Queries the light-curve store. Only the requested rows and columns are read.
+
+    For instance, ``query_lightcurves('2024abc', surveys=['ztf', 'atlas'], mjd_min=60400)``.
+
+    Parameters
+    ----------
+    objects: str or list, default 'None'
+        Object name(s). If ``None``, all the objects are used.
+    surveys: str or list, default 'None'
+        Survey(s). If ``None``, all the surveys are used.
+    filters: str or list, default 'None'
+        Filter(s), without the survey prefix (e.g. 'g'). If ``None``, all the filters are used.
+    mjd_min: float, default 'None'
+        Minimum MJD.
+    mjd_max: float, default 'None'
+        Maximum MJD.
+    columns: list, default 'None'
+        Columns to read (see ``LC_COLUMNS``). If ``None``, all the columns are read.
+    store: str or Path, default 'STORE_FILE'
+        Database file name.
+
+    Returns
+    -------
+    lc_df: DataFrame
+        Matching epochs, sorted by object, survey, filter and MJD.
+    """
+    columns = list(LC_COLUMNS.keys()) if columns is None else list(columns)
+    assert all(column in LC_COLUMNS for column in columns), "Not a valid column!"
+
+    conditions, params = [], []
+    for column, values in [('object', objects), ('survey', surveys), ('filter', filters)]:
+        if values is None:
+            continue
+        values = [values] if isinstance(values, str) else list(values)
+        if column == 'object':
+            values = [normalize_name(value) for value in values]
+        conditions.append(f'{column} IN ({", ".join("?" * len(values))})')
+        params += values
+    if mjd_min is not None:
+        conditions.append('mjd >= ?')
+        params.append(mjd_min)
+    if mjd_max is not None:
+        conditions.append('mjd <= ?')
+        params.append(mjd_max)
+    where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+
+    conn = connect_lightcurve_store(store)
+    try:
+        lc_df = pd.read_sql_query(f'SELECT {", ".join(columns)} FROM photometry{where} '
+                                  'ORDER BY object, survey, filter, mjd', conn, params=params)
+    finally:
+        conn.close()
+
+    return lc_df
+
+def main(args=None):
+    description = f"Unified light-curve store (ZTF, ATLAS, FLOWS, OSC)"
+    usage = "lightcurve_store OBJECT [OBJECT ...] [options]"
+
+    parser = argparse.ArgumentParser(prog='lightcurve_store',
+                                     usage=usage,
+                                     description=description,
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+    parser.add_argument("objects",
+                        nargs="*",
+                        type=str,
+                        help="Objects to query (all if not given), or the object of the imported file."
+                        )
+    parser.add_argument("-i",
+                        "--import",
+                        dest="import_file",
+                        action="store",
+                        type=str,
+                        help=("Light-curve file (CSV) to import, e.g. a '<target>_phot.csv' or "
+                              "'<sn>.phot' file. Requires a single object and the survey.")
+                        )
+    parser.add_argument("-s",
+                        "--surveys",
+                        dest="surveys",
+                        nargs="+",
+                        type=str,
+                        help="Surveys to query, or survey of the imported file."
+                        )
+    parser.add_argument("-f",
+                        "--filters",
+                        dest="filters",
+                        nargs="+",
+                        type=str,
+                        help="Filters to query (e.g. 'g r')."
+                        )
+    parser.add_argument("--mjd_min",
+                        dest="mjd_min",
+                        action="store",
+                        type=float,
+                        help="Minimum MJD."
+                        )
+    parser.add_argument("--mjd_max",
+                        dest="mjd_max",
+                        action="store",
+                        type=float,
+                        help="Maximum MJD."
+                        )
+    parser.add_argument("-o",
+                        "--outfile",
+                        dest="outfile",
+                        action="store",
+                        type=str,
+                        help="Output CSV file for the queried epochs (printed if not given)."
+                        )
+    parser.add_argument("--store",
+                        dest="store",
+                        action="store",
+                        default=str(STORE_FILE),
+                        type=str,
+                        help="Database file."
+                        )
+
+    args = parser.parse_args(args)
+    if args.import_file is not None:
+        if len(args.objects) != 1 or args.surveys is None or len(args.surveys) != 1:
+            parser.error("importing a file requires one object and one survey")
+        # exact MJDs, as the store is keyed on them
+        lc_df = pd.read_csv(args.import_file, float_precision='round_trip')
+        n_rows = save_lightcurve(lc_df, args.objects[0],
+                                 args.surveys[0], args.store)
+        print(f"{n_rows} epochs of {args.objects[0]} ({args.surveys[0]}) saved in '{args.store}'")
+        return
+
+    lc_df = query_lightcurves(args.objects or None, args.surveys, args.filters,
+                              args.mjd_min, args.mjd_max, store=args.store)
+    if args.outfile is not None:
+        lc_df.to_csv(args.outfile, index=False)
+    else:
+        print(lc_df.to_string(index=False))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
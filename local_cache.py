@@ -0,0 +1,41 @@
+import os
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+# local cache of downloaded data and precomputed tables (shared by all the scripts)
+CACHE_DIR = Path(os.environ.get('EXECUTABLES_CACHE_DIR', Path.home() / '.cache' / 'executables'))
+
+@contextmanager
+def atomic_write(outfile, mode='w', permissions=0o666):
+    """Opens a temporary file that replaces the output file once closed,
+    so concurrent readers never see partial files.
+
+    For instance, ``with atomic_write(outfile) as file: json.dump(content, file)``.
+    If writing fails, the output file is left untouched.
+
+    Parameters
+    ----------
+    outfile: str or Path
+        Output file. Its directory is created if needed.
+    mode: str, default 'w'
+        Mode of the file: 'w' (text) or 'wb' (binary).
+    permissions: int, default '0o666'
+        Permissions of the file (before the umask), e.g. ``0o600`` for private files.
+
+    Yields
+    ------
+    file: file object
+        Temporary file.
+    """
+    outfile = Path(outfile)
+    outfile.parent.mkdir(parents=True, exist_ok=True)
+    # unique per process and thread
+    temp_file = outfile.with_name(f'.{outfile.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with open(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, permissions), mode) as file:
+            yield file
+        os.replace(temp_file, outfile)
+    finally:
+        if temp_file.exists():
+            temp_file.unlink()
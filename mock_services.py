@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import time
+import zlib
+import argparse
+import threading
+import numpy as np
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SERVICES = ['tns', 'alerce', 'atlas', 'osc']
+
+def get_seed(name):
+    """Obtains a deterministic seed from a name (e.g. an IAU name).
+    """
+    return zlib.crc32(name.encode())
+
+def load_recording(recordings_dir, service, *path):
+    """Loads a recorded response.
+
+    Recordings are stored as ``<recordings_dir>/<service>/<path>``, e.g.
+    ``alerce/ZTF21abcdefg.json``, ``tns/2021abc.json``, ``osc/SN2011fe.json``
+    or ``atlas/<ra>_<dec>.txt`` (with the same format as the original services).
+
+    Returns
+    -------
+    content: bytes or None
+        Recorded response. ``None`` if not available.
+    """
+    if recordings_dir is None:
+        return None
+    recording = Path(recordings_dir, service, *path)
+    if recording.is_file() is False:
+        return None
+
+    return recording.read_bytes()
+
+def mock_tns_object(objname):
+    """Creates a TNS object record (see ``tns_api.api.get_object``).
+    """
+    rng = np.random.default_rng(get_seed(objname))
+    radeg, decdeg = rng.uniform(0, 360), rng.uniform(-30, 80)
+    disc_mjd = 60000 + rng.uniform(0, 500)
+    disc_date = (np.datetime64('1858-11-17') + np.timedelta64(int(disc_mjd * 86400), 's'))
+    sn_dict = {'objname':objname, 'name_prefix':'SN', 'ra':f'{radeg:.6f}', 'dec':f'{decdeg:.6f}',
+               'radeg':radeg, 'decdeg':decdeg, 'redshift':round(rng.uniform(0.01, 0.1), 4),
+               'hostname':None, 'host_redshift':None, 'object_type':{'name':'SN Ia', 'id':3},
+               'internal_names':f'ZTF{objname[2:]}, ATLAS{objname[2:]}',
+               'discoverydate':f"{str(disc_date).replace('T', ' ')}.000"}
+
+    return sn_dict
+
+def mock_alerce_detections(ztfname):
+    """Creates ZTF detections (see the ALeRCE API).
+    """
+    rng = np.random.default_rng(get_seed(ztfname))
+    mjd = np.sort(60000 + rng.uniform(-20, 150, 60))
+    fid = rng.integers(1, 3, len(mjd))
+    magpsf = 18 + 0.02 * np.abs(mjd - 60020) + rng.normal(0, 0.05, len(mjd))
+    detections = [{'candid':str(get_seed(f'{ztfname}{i}')), 'mjd':mjd[i], 'fid':int(fid[i]),
+                   'magpsf':magpsf[i], 'sigmapsf':0.05}
+                  for i in range(len(mjd))]
+
+    return detections
+
+def mock_atlas_photometry(ra, dec, mjd_min=None, mjd_max=None):
+    """Creates ATLAS forced photometry (see the ATLAS forced-photometry server).
+    """
+    rng = np.random.default_rng(get_seed(f'{ra}_{dec}'))
+    mjd_min = 60000 if mjd_min is None else mjd_min
+    mjd_max = mjd_min + 170 if mjd_max is None else mjd_max
+    mjd = np.sort(rng.uniform(mjd_min, mjd_max, 80))
+    mag = 18.5 + 0.02 * np.abs(mjd - mjd_min - 20) + rng.normal(0, 0.05, len(mjd))
+    lines = ['###MJD          m      dm   uJy   duJy F err chi/N     RA       Dec        x        y     '
+             'maj  min   phi  apfit mag5sig Sky   Obs']
+    for t, m in zip(mjd, mag):
+        ujy = 10 ** (-0.4 * (m - 23.9))
+        lines.append(f'{t:.6f} {m:.3f} 0.050 {ujy:.0f} {0.05 * ujy:.0f} {rng.choice(["c", "o"])} 0 1.00 '
+                     f'{ra:.5f} {dec:.5f} 5000.00 5000.00 2.00 2.00 0.0 -0.400 19.50 20.00 01a{int(t)}o0001c')
+
+    return '\n'.join(lines) + '\n'
+
+def check_limits(service, config, state):
+    """Applies the failure injection and the rate limit of a service.
+
+    Returns
+    -------
+    response: tuple or None
+        Error response (status, headers, body). ``None`` if the request can be served.
+    """
+    with state['lock']:
+        if config['failure_rate'] > 0 and state['rng'].uniform() < config['failure_rate']:
+            return 503, {}, b'Service temporarily unavailable'
+
+        if config['rate_limit'] > 0:
+            now = time.time()
+            window = state['windows'].setdefault(service, {'start':now, 'count':0})
+            if now - window['start'] >= config['rate_window']:
+                window.update(start=now, count=0)
+            window['count'] += 1
+            if window['count'] > config['rate_limit']:
+                reset = int(np.ceil(window['start'] + config['rate_window'] - now))
+                body = json.dumps({'detail':f'Request was throttled. Expected available in {reset} seconds.'})
+                headers = {'x-rate-limit-reset':str(reset), 'Retry-After':str(reset)}
+                return 429, headers, body.encode()
+
+    return None
+
+def handle_request(method, url, body, headers, base_url, config, state):
+    """Answers a request to one of the mock services.
+
+    Parameters
+    ----------
+    method: str
+        HTTP method.
+    url: str
+        Path (and query) of the request, starting with the service name (e.g. '/alerce/...').
+    body: bytes
+        Body of the request.
+    headers: dict
+        Headers of the request.
+    base_url: str
+        Base URL of the server.
+    config: dict
+        Latency, rate limit, failure rate, task duration and recordings directory.
+    state: dict
+        Shared state of the server (counters, rate-limit windows and ATLAS tasks).
+
+    Returns
+    -------
+    status: int
+        HTTP status.
+    headers: dict
+        Response headers.
+    body: bytes
+        Response body.
+    """
+    parsed = urlparse(url)
+    parts = [part for part in parsed.path.split('/') if part]
+    service = parts[0] if parts else None
+    if service == '_stats':
+        with state['lock']:
+            return 200, {'Content-Type':'application/json'}, json.dumps(state['counts']).encode()
+    if service not in SERVICES:
+        return 404, {}, b'Unknown service'
+
+    if config['latency'] > 0:
+        time.sleep(config['latency'] * (1 + config['jitter'] * (2 * np.random.uniform() - 1)))
+    error_response = check_limits(service, config, state)
+    if error_response is not None:
+        return error_response
+
+    json_headers = {'Content-Type':'application/json'}
+    form = {key:values[0] for key, values in parse_qs(body.decode()).items()}
+    if service == 'tns' and method == 'POST' and parts[1:] == ['api', 'get', 'object']:
+        objname = json.loads(form.get('data', '{}')).get('objname', '')
+        recording = load_recording(config['recordings'], 'tns', f'{objname}.json')
+        reply = json.loads(recording) if recording is not None else mock_tns_object(objname)
+        return 200, json_headers, json.dumps({'id_code':200, 'data':{'reply':reply}}).encode()
+
+    if service == 'alerce' and method == 'GET' and len(parts) == 6 and parts[-1] == 'detections':
+        ztfname = parts[-2]
+        recording = load_recording(config['recordings'], 'alerce', f'{ztfname}.json')
+        if recording is None:
+            recording = json.dumps(mock_alerce_detections(ztfname)).encode()
+        return 200, json_headers, recording
+
+    if service == 'osc' and method == 'GET' and len(parts) == 2:
+        recording = load_recording(config['recordings'], 'osc', parts[1])
+        if recording is None:
+            return 404, {}, b'Not found'
+        return 200, json_headers, recording
+
+    if service == 'atlas':
+        if len(parts) < 2:
+            return 404, json_headers, b'{"detail": "Not found."}'
+        if method == 'POST' and parts[1:] == ['api-token-auth']:
+            return 200, json_headers, json.dumps({'token':'mock-token'}).encode()
+        if 'Token' not in headers.get('Authorization', ''):
+            return 401, json_headers, b'{"detail": "Authentication credentials were not provided."}'
+
+        with state['lock']:
+            if method == 'POST' and parts[1:] == ['queue']:
+                # ids are never reused, even after deleting a task (as in ATLAS)
+                task_id = state['next_task_id']
+                state['next_task_id'] += 1
+                task = {'url':f'{base_url}/atlas/queue/{task_id}/', 'timestamp':time.time(),
+                        'starttimestamp':None, 'finishtimestamp':None, 'result_url':None,
+                        'form':form}
+                state['tasks'][task_id] = task
+                return 201, json_headers, json.dumps(task).encode()
+
+            task_id = int(parts[2]) if len(parts) == 3 and parts[2].isdigit() else None
+            task = state['tasks'].get(task_id)
+            if parts[1] == 'queue' and task is None:
+                return 404, json_headers, b'{"detail": "Not found."}'
+            if parts[1] == 'queue' and method == 'DELETE':
+                del state['tasks'][task_id]
+                return 204, {}, b''
+            if parts[1] == 'queue' and method == 'GET':
+                elapsed = time.time() - task['timestamp']
+                if elapsed > config['task_duration'] / 2:
+                    task['starttimestamp'] = task['timestamp'] + config['task_duration'] / 2
+                if elapsed > config['task_duration']:
+                    task['finishtimestamp'] = task['timestamp'] + config['task_duration']
+                    task['result_url'] = f'{base_url}/atlas/results/{task_id}.txt'
+                return 200, json_headers, json.dumps(task).encode()
+
+        if method == 'GET' and parts[1] == 'results' and len(parts) == 3:
+            task_id = parts[2].split('.')[0]
+            task = state['tasks'].get(int(task_id)) if task_id.isdigit() else None
+            if task is None:
+                return 404, {}, b'Not found'
+            ra, dec = float(task['form']['ra']), float(task['form']['dec'])
+            recording = load_recording(config['recordings'], 'atlas', f'{ra}_{dec}.txt')
+            if recording is None:
+                mjd_min = float(task['form']['mjd_min']) if task['form'].get('mjd_min') else None
+                mjd_max = float(task['form']['mjd_max']) if task['form'].get('mjd_max') else None
+                recording = mock_atlas_photometry(ra, dec, mjd_min, mjd_max).encode()
+            return 200, {'Content-Type':'text/plain'}, recording
+
+    return 404, {}, b'Not found'
+
+def serve(host='127.0.0.1', port=8000, latency=0.0, jitter=0.0, rate_limit=0, rate_window=60,
+          failure_rate=0.0, task_duration=5.0, recordings=None, seed=0):
+    """Runs local stand-ins for the TNS, ALeRCE, ATLAS and OSC services.
+
+    The scripts use them when ``EXECUTABLES_BASE_URL`` is set to the URL of this
+    server (see :func:`http_client.get_base_url()`). Use a separate
+    ``EXECUTABLES_CACHE_DIR`` to keep the local caches apart from the real data.
+    Request counts per service and status are available at ``/_stats``.
+
+    Parameters
+    ----------
+    host: str, default '127.0.0.1'
+        Host name.
+    port: int, default '8000'
+        Port number.
+    latency: float, default '0.0'
+        Latency of each request, in seconds.
+    jitter: float, default '0.0'
+        Relative variation of the latency.
+    rate_limit: int, default '0'
+        Maximum number of requests per service and time window (``0`` for no limit).
+        Extra requests get a 429 response with ``x-rate-limit-reset`` and ``Retry-After``
+        headers.
+    rate_window: float, default '60'
+        Time window of the rate limit, in seconds.
+    failure_rate: float, default '0.0'
+        Fraction of requests answered with a 503 error.
+    task_duration: float, default '5.0'
+        Time until the ATLAS tasks finish, in seconds.
+    recordings: str, default 'None'
+        Directory with recorded responses (see :func:`load_recording()`).
+    seed: int, default '0'
+        Seed of the failure injection.
+    """
+    config = {'latency':latency, 'jitter':jitter, 'rate_limit':rate_limit, 'rate_window':rate_window,
+              'failure_rate':failure_rate, 'task_duration':task_duration, 'recordings':recordings}
+    state = {'lock':threading.Lock(), 'rng':np.random.default_rng(seed), 'counts':{},
+             'windows':{}, 'tasks':{}, 'next_task_id':1}
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+
+        def respond(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length) if length > 0 else b''
+            base_url = f'http://{self.headers.get("Host", f"{host}:{port}")}'
+            status, headers, content = handle_request(self.command, self.path, body, dict(self.headers),
+                                                      base_url, config, state)
+            service = self.path.split('/')[1] if self.path.count('/') > 0 else ''
+            with state['lock']:
+                counts = state['counts'].setdefault(service, {})
+                counts[str(status)] = counts.get(str(status), 0) + 1
+
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = do_POST = do_DELETE = respond
+
+        def log_message(self, format, *args):
+            pass
+
+    with ThreadingHTTPServer((host, port), RequestHandler) as server:
+        print(f'Serving {", ".join(SERVICES)} on http://{host}:{server.server_port}', file=sys.stderr)
+        print(f'export EXECUTABLES_BASE_URL=http://{host}:{server.server_port}', file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        print(json.dumps(state['counts']), file=sys.stderr)
+
+def main(args=None):
+    description = f"Local stand-ins for TNS, ALeRCE, ATLAS and OSC"
+    usage = "mock_services [options]"
+
+    parser = argparse.ArgumentParser(prog='mock_services',
+                                     usage=usage,
+                                     description=description,
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+    parser.add_argument("--host",
+                        dest="host",
+                        action="store",
+                        default="127.0.0.1",
+                        type=str,
+                        help="Host name."
+                        )
+    parser.add_argument("-p",
+                        "--port",
+                        dest="port",
+                        action="store",
+                        default=8000,
+                        type=int,
+                        help="Port number."
+                        )
+    parser.add_argument("-l",
+                        "--latency",
+                        dest="latency",
+                        action="store",
+                        default=0.0,
+                        type=float,
+                        help="Latency of each request, in seconds."
+                        )
+    parser.add_argument("--jitter",
+                        dest="jitter",
+                        action="store",
+                        default=0.0,
+                        type=float,
+                        help="Relative variation of the latency."
+                        )
+    parser.add_argument("--rate_limit",
+                        dest="rate_limit",
+                        action="store",
+                        default=0,
+                        type=int,
+                        help="Maximum number of requests per service and time window (0 for no limit)."
+                        )
+    parser.add_argument("--rate_window",
+                        dest="rate_window",
+                        action="store",
+                        default=60,
+                        type=float,
+                        help="Time window of the rate limit, in seconds."
+                        )
+    parser.add_argument("-f",
+                        "--failure_rate",
+                        dest="failure_rate",
+                        action="store",
+                        default=0.0,
+                        type=float,
+                        help="Fraction of requests answered with a 503 error."
+                        )
+    parser.add_argument("--task_duration",
+                        dest="task_duration",
+                        action="store",
+                        default=5.0,
+                        type=float,
+                        help="Time until the ATLAS tasks finish, in seconds."
+                        )
+    parser.add_argument("-r",
+                        "--recordings",
+                        dest="recordings",
+                        action="store",
+                        type=str,
+                        help="Directory with recorded responses (<service>/<name>)."
+                        )
+    parser.add_argument("--seed",
+                        dest="seed",
+                        action="store",
+                        default=0,
+                        type=int,
+                        help="Seed of the failure injection."
+                        )
+
+    args = parser.parse_args(args)
+    serve(args.host, args.port, args.latency, args.jitter, args.rate_limit, args.rate_window,
+          args.failure_rate, args.task_duration, args.recordings, args.seed)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
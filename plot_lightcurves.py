@@ -1,20 +1,26 @@
 #!/usr/bin/env python
 
 import os
+import re
 import sys
+import json
 import time
-from io import StringIO
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 import tns_api
 import requests
+import http_client
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
 from astropy.time import Time
-from astropy.cosmology import FlatLambdaCDM
-COSMO = FlatLambdaCDM(H0=70, Om0=0.3, Tcmb0=2.725)
+from tns_cache import get_object as get_tns_object
+from cosmology import distmod as get_distmod
+from lightcurve_store import STORE_FILE, save_lightcurve, query_lightcurves
+from local_cache import CACHE_DIR, atomic_write
 
 plt.rcParams["font.family"] = "GFS Artemisia"
 plt.rcParams['mathtext.fontset'] = "cm"
@@ -56,13 +62,106 @@ def get_ztfname(sn_dict):
             
     return ztfname
 
-def download_ztf_lightcurve(ztfname):
+def fetch_ztf_detections(ztfname):
+    """Fetches the ZTF detections of a target from ALeRCE.
+    
+    Parameters
+    ----------
+    ztfname: str
+        ZTF internal name.
+    
+    Returns
+    -------
+    det_df: DataFrame
+        ZTF detections.
+    """
+    base_url = http_client.get_base_url('alerce')
+    res = http_client.get(f'{base_url}/ztf/v1/objects/{ztfname}/detections')
+    res.raise_for_status()
+    jsn = res.json()
+    det_df = pd.DataFrame.from_dict(jsn)
+    
+    return det_df
+
+def get_ztf_detections(ztfname, cache_dir=CACHE_DIR, max_age=12, refresh=False):
+    """Obtains the ZTF detections of a target, using a local cache.
+
+    The cached detections are used directly if they were updated less than
+    ``max_age`` hours ago. Otherwise, the detections are fetched from ALeRCE
+    and only those newer than the last cached epoch are merged into the cache. 
+    If ALeRCE cannot be reached or returns no detections, the cached detections
+    are used (offline mode).
+    
+    Parameters
+    ----------
+    ztfname: str
+        ZTF internal name.
+    cache_dir: str or Path, default 'CACHE_DIR'
+        Cache directory.
+    max_age: float, default '12'
+        Maximum age of the cache, in hours.
+    refresh: bool, default 'False'
+        Whether to update the cache regardless of its age.
+    
+    Returns
+    -------
+    det_df: DataFrame
+        ZTF detections.
+    """
+    ztf_dir = Path(cache_dir, 'alerce')
+    cache_file = Path(ztf_dir, f'{ztfname}.csv')
+    meta_file = Path(ztf_dir, f'{ztfname}.json')
+    
+    cached_df, meta = None, None
+    if cache_file.is_file() and meta_file.is_file():
+        cached_df = pd.read_csv(cache_file, float_precision='round_trip')  # exact MJDs
+        with open(meta_file, 'r') as file:
+            meta = json.load(file)
+        age = (time.time() - meta['last_update']) / 3600
+        if age < max_age and refresh is False:
+            return cached_df
+    
+    try:
+        new_df = fetch_ztf_detections(ztfname)
+    except requests.exceptions.RequestException as exc:
+        if cached_df is None:
+            raise
+        print(f'ALeRCE not available ({exc}). Using cached ZTF detections...')
+        return cached_df
+
+    if cached_df is not None and len(new_df) > 0:
+        # merge only the new detections
+        new_df = new_df[new_df.mjd > meta['last_mjd']]
+        det_df = pd.concat([cached_df, new_df], ignore_index=True)
+    elif cached_df is not None:
+        # an empty reply never replaces the cached detections
+        det_df = cached_df
+    else:
+        det_df = new_df
+    if len(det_df) == 0:
+        return det_df
+    
+    # the files are replaced atomically, so readers never see partial files
+    with atomic_write(cache_file) as file:
+        det_df.to_csv(file, index=False)
+    with atomic_write(meta_file) as file:
+        json.dump({'last_update':time.time(), 'last_mjd':float(det_df.mjd.max())}, file)
+
+    return det_df
+
+def download_ztf_lightcurve(ztfname, cache_dir=CACHE_DIR, max_age=12, refresh=False):
     """Downloads the ZTF light curve of a target.
     
     Parameters
     ----------
     ztfname: str
         ZTF internal name.
+    cache_dir: str or Path, default 'CACHE_DIR'
+        Cache directory (see :func:`get_ztf_detections()`).
+    max_age: float, default '12'
+        Maximum age of the cache, in hours.
+    refresh: bool, default 'False'
+        Whether to update the cache regardless of its age.
     
     Returns
     -------
@@ -70,11 +169,7 @@ def download_ztf_lightcurve(ztfname):
         ZTF light curve.
     """
     # get the light curves from Alerce
-    res = requests.get(f'https://api.alerce.online/ztf/v1/objects/{ztfname}/detections')
-    res.raise_for_status()
-    jsn = res.json()
-    
-    phot_df = pd.DataFrame.from_dict(jsn)
+    phot_df = get_ztf_detections(ztfname, cache_dir, max_age, refresh)
     phot_df = phot_df[['fid', 'mjd', 'magpsf', 'sigmapsf']]
     phot_df.rename(columns={'fid':'filter', 
                             'mjd':'time', 
@@ -98,23 +193,167 @@ def download_ztf_lightcurve(ztfname):
 
     return phot_df
 
+def download_ztf_lightcurve_from_tns(tns_future, cache_dir=CACHE_DIR, max_age=12, refresh=False):
+    """Downloads the ZTF light curve of a target as soon as its TNS info is
+    available (see :func:`download_ztf_lightcurve()`).
+    
+    Parameters
+    ----------
+    tns_future: ~concurrent.futures.Future
+        Pending query of the SN info from TNS.
+    cache_dir: str or Path, default 'CACHE_DIR'
+        Cache directory (see :func:`get_ztf_detections()`).
+    max_age: float, default '12'
+        Maximum age of the cache, in hours.
+    refresh: bool, default 'False'
+        Whether to update the cache regardless of its age.
+    
+    Returns
+    -------
+    phot_df: DataFrame or None
+        ZTF light curve. ``None`` if the target has no ZTF name.
+    """
+    ztfname = get_ztfname(tns_future.result())
+    if ztfname is None:
+        return None
+
+    return download_ztf_lightcurve(ztfname, cache_dir, max_age, refresh)
+
 #########
 # ATLAS #
 #########
+ATLAS_STATE_FILE = Path(CACHE_DIR, 'atlas', 'state.json')
+_atlas_state_lock = threading.Lock()
+
+def load_atlas_state():
+    """Loads the local ATLAS state: the authentication token and 
+    the tasks of each position and MJD window.
+
+    Returns
+    -------
+    state: dict
+        ATLAS state, with the ``token`` and ``tasks`` keys.
+    """
+    state = {'token':None, 'tasks':{}}
+    if ATLAS_STATE_FILE.is_file():
+        with open(ATLAS_STATE_FILE, 'r') as file:
+            state.update(json.load(file))
+
+    return state
+
+def update_atlas_state(token=None, task_key=None, **task_info):
+    """Updates the local ATLAS state, which is only readable by the user.
+
+    Parameters
+    ----------
+    token: str, default 'None'
+        Authentication token. An empty string removes the stored token.
+    task_key: str, default 'None'
+        Key of the task (see :func:`get_task_key()`).
+    task_info: dict
+        Information of the task, e.g. ``task_url`` or ``result_file``.
+        ``None`` values remove the information.
+    """
+    with _atlas_state_lock:
+        state = load_atlas_state()
+        if token is not None:
+            state['token'] = token or None
+        if task_key is not None:
+            task = state['tasks'].setdefault(task_key, {})
+            task.update(task_info)
+            state['tasks'][task_key] = {key:value for key, value in task.items() if value is not None}
+
+        with atomic_write(ATLAS_STATE_FILE, permissions=0o600) as file:  # private token
+            json.dump(state, file)
+
+def get_task_key(ra, dec, mjd_min=None, mjd_max=None):
+    """Obtains the key of a task given its position and MJD window.
+    """
+    mjd_min = None if mjd_min is None else round(mjd_min, 4)
+    mjd_max = None if mjd_max is None else round(mjd_max, 4)
+
+    return f'{ra:.6f}_{dec:.6f}_{mjd_min}_{mjd_max}'
+
+def load_atlas_result(task_key, max_age=12):
+    """Loads the forced photometry of a finished task, if available.
+
+    Results are reused if the MJD window had already ended when they were
+    downloaded, or if they are younger than ``max_age`` hours.
+
+    Parameters
+    ----------
+    task_key: str
+        Key of the task (see :func:`get_task_key()`).
+    max_age: float, default '12'
+        Maximum age of results whose MJD window was still open, in hours.
+
+    Returns
+    -------
+    lc_df: DataFrame or None
+        ATLAS forced photometry.
+    """
+    task = load_atlas_state()['tasks'].get(task_key, {})
+    result_file = task.get('result_file')
+    if result_file is None or Path(result_file).is_file() is False:
+        return None
+
+    mjd_max = task.get('mjd_max')
+    window_closed = mjd_max is not None and mjd_max < Time(task['finished'], format='unix').mjd
+    if window_closed is False and (time.time() - task['finished']) / 3600 > max_age:
+        return None
+    lc_df = pd.read_csv(result_file, sep=r"\s+")
+
+    return lc_df
+
+def save_atlas_result(task_key, textdata, mjd_max=None):
+    """Saves the forced photometry of a finished task and removes its task URL.
+
+    Parameters
+    ----------
+    task_key: str
+        Key of the task (see :func:`get_task_key()`).
+    textdata: str
+        Forced photometry, as downloaded.
+    mjd_max: float, default 'None'
+        End of the MJD window of the task.
+
+    Returns
+    -------
+    lc_df: DataFrame
+        ATLAS forced photometry.
+    """
+    result_file = Path(CACHE_DIR, 'atlas', f'{task_key}.txt')
+    with atomic_write(result_file) as file:
+        file.write(textdata.replace("###", ""))
+    update_atlas_state(task_key=task_key, task_url=None, result_file=str(result_file), 
+                       finished=time.time(), mjd_max=mjd_max)
+    lc_df = pd.read_csv(result_file, sep=r"\s+")
+
+    return lc_df
+
+def has_atlas_token():
+    """Checks whether an ATLAS token is available (so no password is needed).
+    """
+    return bool(os.environ.get('ATLASFORCED_SECRET_KEY') or load_atlas_state()['token'])
+
 def get_token(user, password):
-    BASEURL = "https://fallingstar-data.com/forcedphot"
+    BASEURL = http_client.get_base_url('atlas')
     
     if os.environ.get('ATLASFORCED_SECRET_KEY'):
         token = os.environ.get('ATLASFORCED_SECRET_KEY')
         print('Using stored token')
+    elif load_atlas_state()['token']:
+        token = load_atlas_state()['token']
+        print(f'Using cached token (from {ATLAS_STATE_FILE})')
     else:
         data = {'username': user, 'password': password}
-        resp = requests.post(url=f"{BASEURL}/api-token-auth/", data=data)
+        resp = http_client.post(f"{BASEURL}/api-token-auth/", data=data)
 
         if resp.status_code == 200:
             token = resp.json()['token']
-            print(f'Your token is {token}')
-            print('Store this by running/adding to your .zshrc file:')
+            update_atlas_state(token=token)
+            print(f'Your token is {token} (cached in {ATLAS_STATE_FILE})')
+            print('Alternatively, store this by running/adding to your .zshrc file:')
             print(f'export ATLASFORCED_SECRET_KEY="{token}"')
         else:
             print(f'ERROR {resp.status_code}')
@@ -129,36 +368,60 @@ def get_headers(token):
     
     return headers
 
+def get_throttle_wait(message, default=10, min_wait=1):
+    """Obtains the waiting time from an ATLAS throttling message.
+
+    Parameters
+    ----------
+    message: str
+        Message of a 429 response, e.g. 'Request was throttled. Expected 
+        available in 30 seconds.'
+    default: int, default '10'
+        Waiting time if the message does not include it.
+    min_wait: int, default '1'
+        Minimum waiting time (e.g. for 'available in 0 seconds'), so the
+        requests are never repeated without a pause.
+
+    Returns
+    -------
+    waittime: int
+        Waiting time, in seconds.
+    """
+    t_sec = re.findall(r'available in (\d+) seconds', message)
+    t_min = re.findall(r'available in (\d+) minutes', message)
+    if t_sec:
+        waittime = int(t_sec[0])
+    elif t_min:
+        waittime = int(t_min[0]) * 60
+    else:
+        waittime = default
+
+    return max(waittime, min_wait)
+
 def submit_task(ra, dec, headers, mjd_min=None, mjd_max=None):
-    BASEURL = "https://fallingstar-data.com/forcedphot"
+    BASEURL = http_client.get_base_url('atlas')
     
     task_url = None
     while not task_url:
-        with requests.Session() as s:
-            resp = s.post(f"{BASEURL}/queue/", headers=headers, data={
-                'ra': ra, 'dec': dec, 'send_email': False,
-                'mjd_min':mjd_min, 'mjd_max':mjd_max})
+        resp = http_client.post(f"{BASEURL}/queue/", headers=headers, retries=0, data={
+            'ra': ra, 'dec': dec, 'send_email': False,
+            'mjd_min':mjd_min, 'mjd_max':mjd_max})
 
-            if resp.status_code == 201:  # successfully queued
-                task_url = resp.json()['url']
-                print(f'The task URL is {task_url}')
-            elif resp.status_code == 429:  # throttled
-                message = resp.json()["detail"]
-                print(f'{resp.status_code} {message}')
-                t_sec = re.findall(r'available in (\d+) seconds', message)
-                t_min = re.findall(r'available in (\d+) minutes', message)
-                if t_sec:
-                    waittime = int(t_sec[0])
-                elif t_min:
-                    waittime = int(t_min[0]) * 60
-                else:
-                    waittime = 10
-                print(f'Waiting {waittime} seconds')
-                time.sleep(waittime)
-            else:
-                print(f'ERROR {resp.status_code}')
-                print(resp.text)
-                sys.exit()
+        if resp.status_code == 201:  # successfully queued
+            task_url = resp.json()['url']
+            print(f'The task URL is {task_url}')
+        elif resp.status_code == 429:  # throttled
+            message = resp.json()["detail"]
+            print(f'{resp.status_code} {message}')
+            waittime = get_throttle_wait(message)
+            print(f'Waiting {waittime} seconds')
+            time.sleep(waittime)
+        else:
+            print(f'ERROR {resp.status_code}')
+            print(resp.text)
+            if resp.status_code == 401:  # invalid token
+                update_atlas_state(token='')
+            sys.exit()
                 
     return task_url
 
@@ -166,86 +429,360 @@ def get_url(task_url, headers):
     result_url = None
     taskstarted_printed = False
     while not result_url:
-        with requests.Session() as s:
-            resp = s.get(task_url, headers=headers)
-
-            if resp.status_code == 200:  # HTTP OK
-                if resp.json()['finishtimestamp']:
-                    result_url = resp.json()['result_url']
-                    print(f"Task is complete with results available at {result_url}")
-                    if result_url is None:
-                        return None
-                elif resp.json()['starttimestamp']:
-                    if not taskstarted_printed:
-                        print(f"Task is running (started at {resp.json()['starttimestamp']})")
-                        taskstarted_printed = True
-                    time.sleep(2)
-                else:
-                    print(f"Waiting for job to start (queued at {resp.json()['timestamp']})")
-                    time.sleep(4)
+        resp = http_client.get(task_url, headers=headers)
+
+        if resp.status_code == 200:  # HTTP OK
+            if resp.json()['finishtimestamp']:
+                result_url = resp.json()['result_url']
+                print(f"Task is complete with results available at {result_url}")
+                if result_url is None:
+                    return None
+            elif resp.json()['starttimestamp']:
+                if not taskstarted_printed:
+                    print(f"Task is running (started at {resp.json()['starttimestamp']})")
+                    taskstarted_printed = True
+                time.sleep(2)
             else:
-                print(f'ERROR {resp.status_code}')
-                print(resp.text)
-                sys.exit()
+                print(f"Waiting for job to start (queued at {resp.json()['timestamp']})")
+                time.sleep(4)
+        else:
+            print(f'ERROR {resp.status_code}')
+            print(resp.text)
+            sys.exit()
                 
     return result_url
 
 def get_atlas_lightcurves(ra, dec, user, password, mjd_min=None, mjd_max=None):
+    # reuse finished results or resume queued tasks from previous runs
+    task_key = get_task_key(ra, dec, mjd_min, mjd_max)
+    lc_df = load_atlas_result(task_key)
+    if lc_df is not None:
+        print('Using cached ATLAS forced photometry')
+        return lc_df
+
     token = get_token(user, password)
     headers = get_headers(token)
-    task_url = submit_task(ra, dec, headers, mjd_min, mjd_max)
+    task_url = load_atlas_state()['tasks'].get(task_key, {}).get('task_url')
+    if task_url is not None and http_client.get(task_url, headers=headers).status_code == 200:
+        print(f'Resuming task {task_url}')
+    else:
+        task_url = submit_task(ra, dec, headers, mjd_min, mjd_max)
+        update_atlas_state(task_key=task_key, task_url=task_url)
     result_url = get_url(task_url, headers)
     if result_url is None:
+        update_atlas_state(task_key=task_key, task_url=None)
         return None
     
-    with requests.Session() as s:
-        textdata = s.get(result_url, headers=headers).text
-
-    lc_df = pd.read_csv(StringIO(textdata.replace("###", "")), 
-                        delim_whitespace=True)
+    textdata = http_client.get(result_url, headers=headers).text
+    lc_df = save_atlas_result(task_key, textdata, mjd_max)
     
     return lc_df
 
+def process_atlas_lightcurve(downloaded_df):
+    """Converts the ATLAS forced photometry into a light curve.
+
+    Only the detections with a signal-to-noise ratio above 3 are kept.
+
+    Parameters
+    ----------
+    downloaded_df: DataFrame
+        ATLAS forced photometry.
+
+    Returns
+    -------
+    atlas_df: DataFrame
+        ATLAS light curve.
+    """
+    atlas_df = downloaded_df.copy()
+    atlas_df = atlas_df.rename(columns={"MJD":"time", "m":"mag", "dm":"mag_err", "F":"filter"})
+    columns = ['filter', 'time', 'mag', 'mag_err']
+    atlas_df = atlas_df[columns]
+
+    atlas_df["filter"] = "atlas_" + atlas_df["filter"].astype(str).values  # rename filters
+    atlas_df = atlas_df[atlas_df.mag > 0.0]
+    snr = atlas_df.mag.values / atlas_df.mag_err.values
+    atlas_df = atlas_df[snr > 3]
+
+    return atlas_df
+
+def download_atlas_lightcurve(ra, dec, user, password, mjd_min=None, mjd_max=None):
+    """Downloads the ATLAS light curve of a target (see :func:`process_atlas_lightcurve()`).
+
+    Parameters
+    ----------
+    ra: float
+        Right ascension, in degrees.
+    dec: float
+        Declination, in degrees.
+    user: str
+        ATLAS force-photometry username.
+    password: str
+        ATLAS force-photometry password.
+    mjd_min: float, default 'None'
+        Start of the light curve.
+    mjd_max: float, default 'None'
+        End of the light curve.
+
+    Returns
+    -------
+    atlas_df: DataFrame or None
+        ATLAS light curve. ``None`` if the download failed.
+    """
+    try:
+        downloaded_df = get_atlas_lightcurves(ra, dec, user, password, mjd_min, mjd_max)
+        atlas_df = process_atlas_lightcurve(downloaded_df)
+    except Exception as exc:
+        print(exc)
+        print("ATLAS failed. Let's continue without ATLAS...")
+        atlas_df = None
+
+    return atlas_df
+
+def schedule_atlas_tasks(positions, headers, min_poll=2, max_poll=30):
+    """Downloads the ATLAS forced photometry of many positions.
+
+    The tasks are queued as fast as the server allows (waiting for the time
+    given in the throttling messages before submitting again), while all the 
+    queued tasks are polled from the same loop. The polling interval grows
+    while nothing changes and resets when a task finishes. The results are
+    downloaded as soon as a task finishes, and the task is then deleted
+    from the server to free the queue.
+
+    The task URLs and results are recorded in the local ATLAS state
+    (see :func:`update_atlas_state()`), so an interrupted run resumes
+    polling its queued tasks instead of submitting them again.
+
+    Parameters
+    ----------
+    positions: list
+        List of ``(ra, dec, mjd_min, mjd_max)`` tuples.
+    headers: dict
+        Request headers (see :func:`get_headers()`).
+    min_poll: float, default '2'
+        Minimum time between polls, in seconds.
+    max_poll: float, default '30'
+        Maximum time between polls, in seconds.
+
+    Returns
+    -------
+    results: list
+        Forced photometry (DataFrame) of each position, in the same order.
+        ``None`` for failed tasks.
+    """
+    BASEURL = http_client.get_base_url('atlas')
+
+    results = [None] * len(positions)
+    task_keys = [get_task_key(*position) for position in positions]
+    to_submit = []
+    in_flight = {}  # position index: task URL
+    # reuse finished results and resume the tasks queued in previous runs
+    tasks = load_atlas_state()['tasks']
+    for i, task_key in enumerate(task_keys):
+        results[i] = load_atlas_result(task_key)
+        if results[i] is not None:
+            continue
+        task_url = tasks.get(task_key, {}).get('task_url')
+        if task_url is not None:
+            in_flight[i] = task_url
+        else:
+            to_submit.append(i)
+    next_submit = 0.0  # time when a new submission is allowed
+    poll_interval = min_poll
+
+    while to_submit or in_flight:
+        # queue tasks until throttled
+        while to_submit and time.time() >= next_submit:
+            i = to_submit[0]
+            ra, dec, mjd_min, mjd_max = positions[i]
+            resp = http_client.post(f"{BASEURL}/queue/", headers=headers, retries=0, 
+                                    data={'ra': ra, 'dec': dec, 'send_email': False,
+                                          'mjd_min': mjd_min, 'mjd_max': mjd_max})
+            if resp.status_code == 201:  # successfully queued
+                in_flight[i] = resp.json()['url']
+                update_atlas_state(task_key=task_keys[i], task_url=in_flight[i])
+                to_submit.pop(0)
+            elif resp.status_code == 429:  # throttled
+                next_submit = time.time() + get_throttle_wait(resp.json()["detail"])
+            elif resp.status_code >= 500:  # server error: try again later
+                next_submit = time.time() + poll_interval
+            else:
+                print(f'ERROR {resp.status_code} for ({ra}, {dec}): {resp.text}')
+                to_submit.pop(0)
+
+        # poll all the queued tasks
+        n_finished = 0
+        for i, task_url in list(in_flight.items()):
+            resp = http_client.get(task_url, headers=headers, retries=0)
+            if resp.status_code == 429:
+                break  # throttled: poll again later
+            if resp.status_code >= 500:
+                continue  # server error: poll again later
+            if resp.status_code in (403, 404):  # expired task: submit it again
+                del in_flight[i]
+                update_atlas_state(task_key=task_keys[i], task_url=None)
+                to_submit.append(i)
+                continue
+            if resp.status_code != 200 or resp.json()['finishtimestamp']:
+                n_finished += 1
+                del in_flight[i]
+                result_url = resp.json().get('result_url') if resp.status_code == 200 else None
+                if result_url is not None:
+                    textdata = http_client.get(result_url, headers=headers).text
+                    results[i] = save_atlas_result(task_keys[i], textdata, positions[i][3])
+                else:
+                    print(f'Task failed for {positions[i][:2]}: {resp.status_code}')
+                    update_atlas_state(task_key=task_keys[i], task_url=None)
+                http_client.delete(task_url, headers=headers)
+        print(f'ATLAS tasks: {len(to_submit)} to submit, {len(in_flight)} queued, '
+              f'{sum(result is not None for result in results)} downloaded')
+
+        # adaptive backoff
+        if n_finished > 0:
+            poll_interval = min_poll
+        else:
+            poll_interval = min(poll_interval * 1.5, max_poll)
+        if to_submit or in_flight:
+            waittime = poll_interval
+            if to_submit and not in_flight:
+                waittime = max(next_submit - time.time(), 1)
+            time.sleep(waittime)
+
+    return results
+
+def download_atlas_lightcurves(positions, user, password):
+    """Downloads the ATLAS light curves of many targets at once
+    (see :func:`schedule_atlas_tasks()`).
+
+    Parameters
+    ----------
+    positions: list
+        List of ``(ra, dec, mjd_min, mjd_max)`` tuples.
+    user: str
+        ATLAS force-photometry username.
+    password: str
+        ATLAS force-photometry password.
+
+    Returns
+    -------
+    atlas_dfs: list
+        ATLAS light curve (DataFrame) of each target, in the same order.
+        ``None`` for failed downloads.
+    """
+    token = get_token(user, password)
+    headers = get_headers(token)
+    results = schedule_atlas_tasks(positions, headers)
+    atlas_dfs = [process_atlas_lightcurve(result) if result is not None else None 
+                 for result in results]
+
+    return atlas_dfs
+
+#########
+# STORE #
+#########
+def save_lightcurves(iau_name, ztf_df, atlas_df, store=STORE_FILE):
+    """Saves the ZTF and ATLAS light curves of a target into the light-curve store
+    (see :func:`lightcurve_store.save_lightcurve()`).
+    """
+    for survey, lc_df in [('ztf', ztf_df), ('atlas', atlas_df)]:
+        save_lightcurve(lc_df, iau_name, survey, store)
+
+def load_lightcurves(iau_name, store=STORE_FILE):
+    """Loads the ZTF and ATLAS light curves of a target from the light-curve store.
+
+    Returns
+    -------
+    sn_df: DataFrame
+        Light curves, with the same columns as the downloaded ones.
+    """
+    lc_df = query_lightcurves(iau_name, surveys=['ztf', 'atlas'], 
+                              columns=['survey', 'filter', 'mjd', 'mag', 'mag_err'], store=store)
+    sn_df = pd.DataFrame({'filter':lc_df.survey + '_' + lc_df['filter'], 'time':lc_df.mjd,
+                          'mag':lc_df.mag, 'mag_err':lc_df.mag_err})
+
+    return sn_df
+
 #########
 # PLOTS #
 #########
+def bin_lightcurves(sn_df, dx=1, weighting='mean', flux_space=False):
+    """Combines the data of all filters given a window size, in a single 
+    vectorized pass.
+
+    The bins of each filter start at its first epoch. The data is sorted by
+    filter and bin, and the sums of each bin are obtained with ``np.add.reduceat``.
+
+    Parameters
+    ----------
+    sn_df: DataFrame
+        Light curves with ``filter``, ``time``, ``mag`` and ``mag_err`` columns.
+    dx: float, default '1'
+        Window size, in days.
+    weighting: str, default 'mean'
+        Either 'mean' (unweighted mean, with the root-mean-square of the errors)
+        or 'inverse-variance' (weighted mean and its error).
+    flux_space: bool, default 'False'
+        Whether to average fluxes instead of magnitudes.
+
+    Returns
+    -------
+    binned_df: DataFrame
+        Binned light curves, grouped by filter and sorted by time.
+    """
+    assert weighting in ['mean', 'inverse-variance'], "Not a valid weighting!"
+    columns = ['filter', 'time', 'mag', 'mag_err']
+    if sn_df is None or len(sn_df) == 0:
+        return pd.DataFrame(columns=columns)
+
+    filter_codes, filter_names = pd.factorize(sn_df['filter'])
+    x = sn_df.time.values.astype(float)
+    y = sn_df.mag.values.astype(float)
+    yerr = sn_df.mag_err.values.astype(float)
+    if flux_space:
+        y = 10 ** (-0.4 * y)
+        yerr = y * yerr * np.log(10) / 2.5
+
+    # bin index relative to the first epoch of each filter
+    x_min = np.full(len(filter_names), np.inf)
+    np.minimum.at(x_min, filter_codes, x)
+    bin_indices = np.floor((x - x_min[filter_codes]) / dx).astype(np.int64)
+    group_keys = filter_codes.astype(np.int64) * (bin_indices.max() + 1) + bin_indices
+
+    order = np.argsort(group_keys, kind='stable')
+    group_keys, x, y, yerr = group_keys[order], x[order], y[order], yerr[order]
+    starts = np.flatnonzero(np.r_[True, group_keys[1:] != group_keys[:-1]])
+    counts = np.diff(np.r_[starts, len(group_keys)])
+
+    if weighting == 'mean':
+        weights = np.ones_like(y)
+    else:
+        weights = 1 / yerr ** 2
+    sum_weights = np.add.reduceat(weights, starts)
+    binned_x = np.add.reduceat(weights * x, starts) / sum_weights
+    binned_y = np.add.reduceat(weights * y, starts) / sum_weights
+    if weighting == 'mean':
+        binned_yerr = np.sqrt(np.add.reduceat(yerr ** 2, starts) / counts)
+    else:
+        binned_yerr = 1 / np.sqrt(sum_weights)
+
+    if flux_space:
+        binned_yerr = 2.5 / np.log(10) * binned_yerr / binned_y
+        binned_y = -2.5 * np.log10(binned_y)
+
+    binned_df = pd.DataFrame({'filter':filter_names[filter_codes[order][starts]],
+                              'time':binned_x, 'mag':binned_y, 'mag_err':binned_yerr})
+
+    return binned_df[columns]
+
 def bin_data(x, y, yerr, dx):
     """Combines the dat given a window size. 
     """
-    # Initialize lists to store statistics for each bin
-    binned_x = []
-    binned_y = []
-    binned_yerr = []
-
-    bin_edges = np.arange(x.min(), x.max() + dx, dx)
-    bin_indices = np.digitize(x, bin_edges)
+    sn_df = pd.DataFrame({'filter':'', 'time':x, 'mag':y, 'mag_err':yerr})
+    binned_df = bin_lightcurves(sn_df, dx)
     
-    # Compute statistics for each bin
-    for i in range(1, len(bin_edges)):
-        # Select data points that fall into the current bin
-        bin_x = x[bin_indices == i]
-        bin_y = y[bin_indices == i]
-        bin_yerr = yerr[bin_indices == i]
-        
-        # Calculate and store statistics if bin_data is not empty
-        if len(bin_x) > 0:
-            binned_x.append(np.mean(bin_x))
-            binned_y.append(np.mean(bin_y))
-            binned_yerr.append(np.sqrt(np.sum(bin_yerr ** 2) / len(bin_yerr)))
-        else:
-            binned_x.append(np.nan)
-            binned_y.append(np.nan)
-            binned_yerr.append(np.nan)
-    
-    # remove NaNs
-    nan_mask = ~np.isnan(binned_x)
-    binned_x = np.array(binned_x)[nan_mask]
-    binned_y = np.array(binned_y)[nan_mask]
-    binned_yerr = np.array(binned_yerr)[nan_mask]
-
-    return binned_x, binned_y, binned_yerr
+    return binned_df.time.values, binned_df.mag.values, binned_df.mag_err.values
 
-def plot_lcs(sn_df, iauname, z=None, bin=True):
+def plot_lcs(sn_df, iauname, z=None, bin=True, dx=1, weighting='mean', flux_space=False, 
+             outfile=None):
     filters = {"ztf_g":"g", 
                "ztf_r":"r", 
                "atlas_c":"cyan", 
@@ -255,12 +792,17 @@ def plot_lcs(sn_df, iauname, z=None, bin=True):
     fig, ax = plt.subplots()
     if z is not None:
         title = fr'{iauname} ($z={z:.4f}$)'
+        distmod = get_distmod(z, 'FlatLambdaCDM')
         ax2 = ax.twinx()
         ax2.invert_yaxis()
         ax2.set_ylabel('Absolute Magnitude', fontsize=18, rotation=-90, labelpad=15)
         ax2.tick_params(labelsize=18)
     else:
         title = iauname
+
+    if bin is True:
+        # combine data 
+        sn_df = bin_lightcurves(sn_df, dx, weighting, flux_space)
         
     for filt in filters.keys():
         if filt not in sn_df["filter"].values:
@@ -269,14 +811,9 @@ def plot_lcs(sn_df, iauname, z=None, bin=True):
         times = filt_df.time.values
         mags = filt_df.mag.values
         mags_err = filt_df.mag_err.values
-
-        if bin is True:
-            # combine data 
-            times, mags, mags_err = bin_data(times, mags, mags_err, dx=1)
         
         ax.errorbar(times, mags, yerr=mags_err, color=filters[filt], label=filt, marker="o", ls="--")
         if z is not None:
-            distmod = COSMO.distmod(z).value
             ax2.errorbar(times, mags - distmod, yerr=mags_err, color=filters[filt], marker="o", ls="--")
                 
     ax.invert_yaxis()
@@ -286,7 +823,177 @@ def plot_lcs(sn_df, iauname, z=None, bin=True):
     ax.tick_params(labelsize=18)
     ax.legend(fontsize=18)
     plt.tight_layout()
-    plt.show()
+    if outfile is None:
+        plt.show()
+    else:
+        fig.savefig(outfile)
+        plt.close(fig)
+
+#########
+# BATCH #
+#########
+def read_targets(targets_file):
+    """Reads a list of targets (one IAU name per line; '#' for comments).
+
+    Parameters
+    ----------
+    targets_file: str
+        File with the targets.
+
+    Returns
+    -------
+    iau_names: list
+        IAU names of the targets.
+    """
+    iau_names = []
+    with open(targets_file, 'r') as file:
+        for line in file:
+            line = line.split('#')[0].strip()
+            if line:
+                iau_names.append(line.split()[0])
+
+    return iau_names
+
+def fetch_target(iau_name, max_age=12, refresh=False):
+    """Fetches the TNS info and the ZTF light curve of a target.
+
+    Parameters
+    ----------
+    iau_name: str
+        IAU name of the target.
+    max_age: float, default '12'
+        Maximum age of the cached ZTF detections, in hours.
+    refresh: bool, default 'False'
+        Whether to update the cached ZTF detections regardless of their age.
+
+    Returns
+    -------
+    sn_dict: dict
+        SN info from TNS.
+    ztf_df: DataFrame or None
+        ZTF light curve.
+    """
+    sn_dict = get_tns_object(iau_name)
+    ztfname = get_ztfname(sn_dict)
+    if ztfname is not None:
+        ztf_df = download_ztf_lightcurve(ztfname, max_age=max_age, refresh=refresh)
+    else:
+        ztf_df = None
+
+    return sn_dict, ztf_df
+
+def plot_lightcurves_batch(iau_names, user, password, outdir='.', n_workers=4, 
+                           max_age=12, refresh=False, bin=True, dx=1, 
+                           weighting='mean', flux_space=False, fmt='png', store=None):
+    """Plots the light curves of many targets, saving the figures to disk.
+
+    The TNS info and ZTF light curves are fetched in parallel (at most ``n_workers``
+    targets at once), the ATLAS light curves of all the targets are downloaded 
+    together (see :func:`download_atlas_lightcurves()`), and the figures are 
+    rendered without a display. Failures of single targets do not stop the batch.
+
+    Parameters
+    ----------
+    iau_names: list
+        IAU names of the targets.
+    user: str
+        ATLAS force-photometry username.
+    password: str
+        ATLAS force-photometry password.
+    outdir: str, default '.'
+        Directory where to save the figures.
+    n_workers: int, default '4'
+        Maximum number of targets fetched at the same time.
+    max_age: float, default '12'
+        Maximum age of the cached ZTF detections, in hours.
+    refresh: bool, default 'False'
+        Whether to update the cached ZTF detections regardless of their age.
+    bin: bool, default 'True'
+        Whether to bin the data.
+    dx: float, default '1'
+        Window size used for binning the data, in days.
+    weighting: str, default 'mean'
+        Weighting used for binning the data.
+    flux_space: bool, default 'False'
+        Whether to average fluxes instead of magnitudes when binning the data.
+    fmt: str, default 'png'
+        Format of the figures.
+    store: str, default 'None'
+        If given, the light curves are saved into this light-curve store.
+
+    Returns
+    -------
+    summary_df: DataFrame
+        Status, number of detections and timing (in seconds) of each target.
+        The ATLAS download time is shared by all the targets.
+    """
+    plt.switch_backend('Agg')
+    Path(outdir).mkdir(parents=True, exist_ok=True)
+    summary = {iau_name:{'iau_name':iau_name, 'status':'ok', 'n_ztf':0, 'n_atlas':0, 
+                         'fetch_time':np.nan, 'plot_time':np.nan, 'outfile':None, 'error':None}
+               for iau_name in iau_names}
+    iau_names = list(summary.keys())  # without duplicates
+
+    def timed_fetch(iau_name):
+        start = time.perf_counter()
+        try:
+            return fetch_target(iau_name, max_age, refresh), None, time.perf_counter() - start
+        except Exception as exc:
+            return None, exc, time.perf_counter() - start
+
+    # TNS + ZTF
+    print(f"Fetching TNS and ZTF data of {len(iau_names)} targets...")
+    targets = {}
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for iau_name, (result, exc, fetch_time) in zip(iau_names, executor.map(timed_fetch, iau_names)):
+            summary[iau_name]['fetch_time'] = fetch_time
+            if exc is not None:
+                summary[iau_name].update({'status':'failed', 'error':f'{type(exc).__name__}: {exc}'})
+                print(f'{iau_name}: {exc}')
+            else:
+                targets[iau_name] = result
+
+    # ATLAS
+    print(f"Downloading ATLAS light curves of {len(targets)} targets...")
+    start = time.perf_counter()
+    positions = []
+    for sn_dict, _ in targets.values():
+        disc_time = Time(sn_dict['discoverydate'].replace(" ", "T"), format='isot', scale='utc').mjd
+        positions.append((sn_dict['radeg'], sn_dict['decdeg'], disc_time - 20, disc_time + 150))
+    try:
+        atlas_dfs = download_atlas_lightcurves(positions, user, password) if positions else []
+    except (Exception, SystemExit) as exc:
+        print(f"ATLAS failed ({exc}). Let's continue without ATLAS...")
+        atlas_dfs = [None] * len(positions)
+    atlas_time = time.perf_counter() - start
+
+    # plots
+    print("Plotting light curves...")
+    for (iau_name, (sn_dict, ztf_df)), atlas_df in zip(targets.items(), atlas_dfs):
+        start = time.perf_counter()
+        target_summary = summary[iau_name]
+        target_summary['n_ztf'] = len(ztf_df) if ztf_df is not None else 0
+        target_summary['n_atlas'] = len(atlas_df) if atlas_df is not None else 0
+        try:
+            if store is not None:
+                save_lightcurves(iau_name, ztf_df, atlas_df, store)
+            sn_df = pd.concat([ztf_df, atlas_df])
+            if len(sn_df) == 0:
+                raise ValueError('no photometry found')
+            outfile = Path(outdir, f'{iau_name}.{fmt}')
+            plot_lcs(sn_df, iau_name, sn_dict['redshift'], bin, dx, weighting, flux_space, outfile)
+            target_summary['outfile'] = str(outfile)
+            if atlas_df is None:
+                target_summary['status'] = 'partial'
+        except Exception as exc:
+            target_summary.update({'status':'failed', 'error':f'{type(exc).__name__}: {exc}'})
+            print(f'{iau_name}: {exc}')
+        target_summary['plot_time'] = time.perf_counter() - start
+
+    summary_df = pd.DataFrame(summary.values())
+    summary_df['atlas_time'] = atlas_time
+
+    return summary_df
 
 ########
 # MAIN #
@@ -296,7 +1003,7 @@ from getpass import getpass
 
 def main(args=None):
     description = f"Plotting ZTF and ATLAS light curves by T. Müller-Bravo"
-    usage = "plot_lightcurves IAU_NAME [options]"
+    usage = "plot_lightcurves IAU_NAME [IAU_NAME ...] [options]"
     
     if not args:
         args = sys.argv[1:] if sys.argv[1:] else ["--help"]
@@ -308,8 +1015,32 @@ def main(args=None):
                                      )
     parser.add_argument("iau_name",
                         action="store",
+                        nargs="*",
                         type=str,
-                        help="The object to plot (e.g. 2024xxx)."
+                        help="The object(s) to plot (e.g. 2024xxx). More than one object runs the batch mode."
+                        )
+    parser.add_argument("-t",
+                        "--targets",
+                        dest="targets",
+                        action="store",
+                        type=str,
+                        help=("File with the objects to plot, one per line (batch mode).")
+                        )
+    parser.add_argument("-o",
+                        "--outdir",
+                        dest="outdir",
+                        action="store",
+                        type=str,
+                        help=("Directory where to save the figures instead of showing them (always used in batch mode, "
+                              "defaults to the current directory).")
+                        )
+    parser.add_argument("-j",
+                        "--n_workers",
+                        dest="n_workers",
+                        action="store",
+                        default=4,
+                        type=int,
+                        help=("Maximum number of objects fetched at the same time (batch mode).")
                         )
     parser.add_argument("-z",
                         dest="z",
@@ -331,67 +1062,147 @@ def main(args=None):
                         type=str,
                         help=("ATLAS force-photometry username (fallingstar website).")
                         )
+    parser.add_argument("--max-age",
+                        dest="max_age",
+                        action="store",
+                        default=12,
+                        type=float,
+                        help=("Maximum age of the cached ZTF detections, in hours.")
+                        )
+    parser.add_argument("--refresh",
+                        dest="refresh",
+                        action="store_true", 
+                        help=("Updates the cached ZTF detections regardless of their age.")
+                        )
+    parser.add_argument("--store",
+                        dest="store",
+                        nargs="?",
+                        const=str(STORE_FILE),
+                        type=str,
+                        help=(f"Saves the light curves into the light-curve store (default: {STORE_FILE}).")
+                        )
+    parser.add_argument("--from-store",
+                        dest="from_store",
+                        action="store_true", 
+                        help=("Plots the light curves saved in the light-curve store, without downloading them.")
+                        )
     parser.add_argument("--no-bin",
                         dest="bin",
                         action="store_false", 
-                        help=("Disables the binning of data using a 1-day window.")
+                        help=("Disables the binning of data.")
+                        )
+    parser.add_argument("--bin-size",
+                        dest="bin_size",
+                        action="store",
+                        default=1.0,
+                        type=float,
+                        help=("Window size used for binning the data, in days.")
+                        )
+    parser.add_argument("--weighting",
+                        dest="weighting",
+                        action="store",
+                        default="mean",
+                        choices=["mean", "inverse-variance"],
+                        type=str,
+                        help=("Weighting used for binning the data.")
+                        )
+    parser.add_argument("--flux-space",
+                        dest="flux_space",
+                        action="store_true", 
+                        help=("Averages fluxes instead of magnitudes when binning the data.")
                         )
     
     # Run script
     args = parser.parse_args(args)
-    # SN info
-    sn_dict = tns_api.api.get_object(args.iau_name)
-    ra, dec = sn_dict['radeg'], sn_dict['decdeg']
-    if args.z is None:
-        z = sn_dict['redshift']
-    else:
-        z = args.z
-    if args.ztfname is None: 
-        ztfname = get_ztfname(sn_dict)
-    else:
-        ztfname = args.ztfname
-
-    # ZTF light curve
-    if ztfname is not None:
-        print("Downloading ZTF light curves...\n")
-        ztf_df = download_ztf_lightcurve(ztfname)
-    else:
-        ztf_df = None
-        print("No ZTF name found!\n")
-
-    # ATLAS light curve
-    disc_date = sn_dict['discoverydate'].replace(" ", "T")
-    disc_time = Time(disc_date, format='isot', scale='utc').mjd
-    
-    print("Downloading ATLAS light curves...")
     # credentials from fallingstar website
     if args.username is not None: 
         user = args.username
     else:
         user = 't.e.muller-bravo'
-    password = str(getpass("ATLAS Force Photometry Password:"))
-    try:
-        downloaded_df = get_atlas_lightcurves(ra, dec, user, password, disc_time - 20, disc_time + 150)
-        
-        atlas_df = downloaded_df.copy()
-        atlas_df = atlas_df.rename(columns={"MJD":"time", "m":"mag", "dm":"mag_err", "F":"filter"})
-        columns = ['filter', 'time', 'mag', 'mag_err']
-        atlas_df = atlas_df[columns]
-
-        atlas_df["filter"] = "atlas_" + atlas_df["filter"].astype(str).values  # rename filters
-        atlas_df = atlas_df[atlas_df.mag > 0.0]
-        snr = atlas_df.mag.values / atlas_df.mag_err.values
-        atlas_df = atlas_df[snr > 3]
-    except Exception as exc:
-        print(exc)
-        print("ATLAS failed. Let's continue without ATLAS...")
-        atlas_df = None
+
+    iau_names = list(args.iau_name)
+    if args.targets is not None:
+        iau_names += read_targets(args.targets)
+    if len(iau_names) == 0:
+        parser.error("no object given")
+    elif args.from_store is True:
+        store = args.store if args.store is not None else STORE_FILE
+        batch = len(iau_names) > 1 or args.targets is not None
+        if batch:
+            plt.switch_backend('Agg')
+        for iau_name in iau_names:
+            sn_df = load_lightcurves(iau_name, store)
+            if len(sn_df) == 0:
+                print(f"{iau_name}: no light curves in '{store}'")
+                continue
+            outdir = args.outdir if args.outdir is not None else ('.' if batch else None)
+            outfile = Path(outdir, f'{iau_name}.png') if outdir is not None else None
+            if outfile is not None:
+                outfile.parent.mkdir(parents=True, exist_ok=True)
+            plot_lcs(sn_df, iau_name, args.z, bool(args.bin), args.bin_size, args.weighting, 
+                     args.flux_space, outfile)
+        return
+    elif len(iau_names) > 1 or args.targets is not None:
+        password = None if has_atlas_token() else str(getpass("ATLAS Force Photometry Password:"))
+        outdir = args.outdir if args.outdir is not None else '.'
+        summary_df = plot_lightcurves_batch(iau_names, user, password, outdir, args.n_workers, 
+                                            args.max_age, args.refresh, bool(args.bin), 
+                                            args.bin_size, args.weighting, args.flux_space, 
+                                            store=args.store)
+        summary_df.to_csv(Path(outdir, 'summary.csv'), index=False)
+        print()
+        print(summary_df.drop(columns=['outfile', 'error']).to_string(index=False, float_format='%.2f'))
+        n_ok = (summary_df.status != 'failed').sum()
+        print(f"\n{n_ok}/{len(summary_df)} light curves saved in '{outdir}'")
+        return
+    iau_name = iau_names[0]
+
+    # the downloads run in the background while waiting for TNS and the password
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        tns_future = executor.submit(get_tns_object, iau_name)
+        print("Downloading ZTF light curves...\n")
+        if args.ztfname is not None:
+            ztf_future = executor.submit(download_ztf_lightcurve, args.ztfname, 
+                                         max_age=args.max_age, refresh=args.refresh)
+        else:
+            # the ZTF name comes from TNS: both queries run in the same task
+            ztf_future = executor.submit(download_ztf_lightcurve_from_tns, tns_future, 
+                                         max_age=args.max_age, refresh=args.refresh)
+        if has_atlas_token():
+            password = None  # not needed with a cached token
+        else:
+            password = str(getpass("ATLAS Force Photometry Password:"))
+
+        # SN info
+        sn_dict = tns_future.result()
+        ra, dec = sn_dict['radeg'], sn_dict['decdeg']
+        if args.z is None:
+            z = sn_dict['redshift']
+        else:
+            z = args.z
+
+        # ATLAS light curve
+        disc_date = sn_dict['discoverydate'].replace(" ", "T")
+        disc_time = Time(disc_date, format='isot', scale='utc').mjd
+        print("Downloading ATLAS light curves...")
+        atlas_future = executor.submit(download_atlas_lightcurve, ra, dec, user, password, 
+                                       disc_time - 20, disc_time + 150)
+
+        ztf_df = ztf_future.result()
+        if ztf_df is None:
+            print("No ZTF name found!\n")
+        atlas_df = atlas_future.result()
 
     # merge ZTF + ATLAS
+    if args.store is not None:
+        save_lightcurves(iau_name, ztf_df, atlas_df, args.store)
     sn_df = pd.concat([ztf_df, atlas_df])
 
     print("\nPlotting light curves...")
-    plot_lcs(sn_df, args.iau_name, z, bool(args.bin))
+    outfile = Path(args.outdir, f'{iau_name}.png') if args.outdir is not None else None
+    if outfile is not None:
+        outfile.parent.mkdir(parents=True, exist_ok=True)
+    plot_lcs(sn_df, iau_name, z, bool(args.bin), args.bin_size, args.weighting, args.flux_space, outfile)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -1,10 +1,7 @@
 #!/usr/bin/env python
 
 import subprocess
-try:
-    from tns_api.api import get_object
-except:
-    pass
+from tns_cache import get_object
 
 def main():
     sn_name = input('Enter the SN IAU name (e.g., 2022vqz) or ZTF internal name (e.g. ZTF22abhrjld):')
@@ -33,4 +30,5 @@ def main():
     for url in urls:
         subprocess.call(['firefox', '-new-tab', '-url', url])
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+from local_cache import CACHE_DIR, atomic_write
+
+TNS_CACHE_DIR = Path(CACHE_DIR, 'tns')
+
+_records = {}  # in-memory copy of the records read in this process
+
+def normalize_name(iau_name):
+    """Normalises an IAU name, removing the 'SN'/'AT' prefix and spaces
+    (e.g. 'SN 2011fe' -> '2011fe').
+    """
+    return re.sub(r'^(SN|AT)\s*', '', iau_name.strip(), flags=re.IGNORECASE).replace(' ', '')
+
+def get_credentials():
+    """Obtains the credentials of the TNS bot.
+
+    They are given by the ``TNS_BOT_ID``, ``TNS_BOT_NAME`` and ``TNS_API_KEY``
+    environment variables or, otherwise, by the ``tns_api`` configuration
+    (e.g. the '.env' file created by ``plot_lightcurves``).
+
+    Returns
+    -------
+    tns_id: str or None
+        ID of the bot.
+    name: str or None
+        Name of the bot.
+    api_key: str or None
+        API key of the bot.
+    """
+    credentials = [os.environ.get(variable) for variable in ['TNS_BOT_ID', 'TNS_BOT_NAME', 'TNS_API_KEY']]
+    if None in credentials:
+        try:
+            from tns_api import credentials as tns_credentials
+            defaults = [tns_credentials.TNS_ID, tns_credentials.TNS_BOT_NAME, tns_credentials.TNS_API_KEY]
+        except ImportError:
+            defaults = [None, None, None]
+        credentials = [value if value is not None else default
+                       for value, default in zip(credentials, defaults)]
+
+    return tuple(credentials)
+
+def fetch_object(iau_name):
+    """Fetches the record of an object from TNS, through the shared HTTP client
+    (see :func:`http_client.request()`), so the TNS rate limit is honoured.
+
+    Parameters
+    ----------
+    iau_name: str
+        Normalised IAU name.
+
+    Returns
+    -------
+    record: dict or None
+        Object record from TNS. ``None`` if the object is not found.
+    """
+    tns_id, name, api_key = get_credentials()
+    headers = {'User-Agent':f'tns_marker{{"tns_id": "{tns_id}", "type": "bot", "name": "{name}"}}'}
+    data = {'api_key':api_key,
+            'data':json.dumps({'objname':iau_name, 'photometry':'0', 'spectra':'0'})}
+    resp = http_client.post(f"{http_client.get_base_url('tns')}/api/get/object",
+                            headers=headers, data=data)
+    resp.raise_for_status()
+
+    record = resp.json()['data']
+    record = record.get('reply', record)  # older versions of the TNS API
+    if 'objname' not in record:
+        return None
+
+    return record
+
+def read_record(iau_name):
+    """Reads the cached record of an object.
+
+    Parameters
+    ----------
+    iau_name: str
+        Normalised IAU name.
+
+    Returns
+    -------
+    entry: dict or None
+        Cached entry, with the ``fetched`` (unix time) and ``record`` keys.
+    """
+    if iau_name in _records:
+        return _records[iau_name]
+
+    cache_file = Path(TNS_CACHE_DIR, f'{iau_name}.json')
+    try:
+        with open(cache_file, 'r') as file:
+            entry = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    _records[iau_name] = entry
+
+    return entry
+
+def write_record(iau_name, record):
+    """Writes the record of an object into the cache (atomically).
+
+    Parameters
+    ----------
+    iau_name: str
+        Normalised IAU name.
+    record: dict
+        Object record from TNS.
+
+    Returns
+    -------
+    entry: dict
+        Cached entry, with the ``fetched`` (unix time) and ``record`` keys.
+    """
+    entry = {'fetched':time.time(), 'record':record}
+    with atomic_write(Path(TNS_CACHE_DIR, f'{iau_name}.json')) as file:
+        json.dump(entry, file, default=str)
+    _records[iau_name] = entry
+
+    return entry
+
+def get_object(iau_name, ttl=24, refresh=False, fetch=fetch_object):
+    """Obtains the TNS record of an object, using the shared local cache.
+
+    Cached records younger than ``ttl`` hours are returned without querying TNS.
+    If TNS cannot be reached, an expired record is returned instead (offline mode).
+
+    Parameters
+    ----------
+    iau_name: str
+        IAU name of the object (e.g. 2011fe).
+    ttl: float, default '24'
+        Time to live of the cached records, in hours.
+    refresh: bool, default 'False'
+        Whether to query TNS regardless of the age of the cached record.
+    fetch: callable, default 'fetch_object'
+        Function used to query TNS.
+
+    Returns
+    -------
+    record: dict
+        Object record from TNS.
+    """
+    iau_name = normalize_name(iau_name)
+    entry = read_record(iau_name)
+    if entry is not None and refresh is False:
+        if (time.time() - entry['fetched']) / 3600 < ttl:
+            return entry['record']
+
+    try:
+        record = fetch(iau_name)
+    except Exception as exc:
+        if entry is None:
+            raise
+        print(f'TNS not available ({exc}). Using cached record of {iau_name}...')
+        return entry['record']
+    if not record:
+        raise ValueError(f'{iau_name} not found on TNS')
+    write_record(iau_name, record)
+
+    return record
+
+def prefetch(iau_names, ttl=24, refresh=False, n_workers=2, fetch=fetch_object):
+    """Fills the cache with the records of many objects. Objects with
+    valid cached records are not queried.
+
+    Parameters
+    ----------
+    iau_names: list
+        IAU names of the objects.
+    ttl: float, default '24'
+        Time to live of the cached records, in hours.
+    refresh: bool, default 'False'
+        Whether to query TNS regardless of the age of the cached records.
+    n_workers: int, default '2'
+        Maximum number of simultaneous queries.
+    fetch: callable, default 'fetch_object'
+        Function used to query TNS.
+
+    Returns
+    -------
+    failed: dict
+        Error message of each object that could not be fetched.
+    """
+    def prefetch_object(iau_name):
+        try:
+            get_object(iau_name, ttl, refresh, fetch)
+        except Exception as exc:
+            return f'{type(exc).__name__}: {exc}'
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        errors = executor.map(prefetch_object, iau_names)
+        failed = {iau_name:error for iau_name, error in zip(iau_names, errors) if error is not None}
+
+    return failed
+
+def main(args=None):
+    description = f"Prefetches TNS records into the shared local cache"
+    usage = "tns_cache [IAU_NAME ...] [options]"
+
+    parser = argparse.ArgumentParser(prog='tns_cache',
+                                     usage=usage,
+                                     description=description,
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                                     )
+    parser.add_argument("iau_name",
+                        nargs="*",
+                        type=str,
+                        help="Objects to prefetch (e.g. 2011fe)."
+                        )
+    parser.add_argument("-t",
+                        "--targets",
+                        dest="targets",
+                        action="store",
+                        type=str,
+                        help="File with the objects to prefetch, one per line."
+                        )
+    parser.add_argument("--ttl",
+                        dest="ttl",
+                        action="store",
+                        default=24,
+                        type=float,
+                        help="Time to live of the cached records, in hours."
+                        )
+    parser.add_argument("--refresh",
+                        dest="refresh",
+                        action="store_true",
+                        help="Queries TNS regardless of the age of the cached records."
+                        )
+    parser.add_argument("-j",
+                        "--n_workers",
+                        dest="n_workers",
+                        action="store",
+                        default=2,
+                        type=int,
+                        help="Maximum number of simultaneous queries."
+                        )
+
+    args = parser.parse_args(args)
+    iau_names = list(args.iau_name)
+    if args.targets is not None:
+        with open(args.targets, 'r') as file:
+            iau_names += [line.split('#')[0].split()[0] for line in file
+                          if line.split('#')[0].strip()]
+    if len(iau_names) == 0:
+        parser.error("no object given")
+
+    failed = prefetch(iau_names, args.ttl, args.refresh, args.n_workers)
+    for iau_name, error in failed.items():
+        print(f'{iau_name} failed: {error}')
+    print(f"{len(iau_names) - len(failed)}/{len(iau_names)} records cached in '{TNS_CACHE_DIR}'")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])